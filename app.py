@@ -1,22 +1,27 @@
 import streamlit as st
-import pandas as pd
 import os
-import requests
 import time
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 import streamlit.components.v1 as components
-import gspread 
-from google.oauth2.service_account import Credentials 
 from datetime import datetime 
-import concurrent.futures  # ⭐ 新增：強大的多執行緒加速模組
+from scan_index import ScanIndex  # ⭐ 新增：TG3D 帳號本地索引 (SQLite，增量同步)
+from scan_poller import ScanPoller
+from tg3d_client import TG3DClient, BASE_URL, get_tg3d_float
+from ttl_cache import TTLCache
+from metrics import METRICS, stage
+from size_engine import SizeEngine, ASYMMETRY_CM
+from catalog import RecommendationCatalog, ATTR_OPTIONS
+from email_outbox import EmailOutbox
+from image_cache import ImageCache
+from gsheets_queue import SheetLogQueue, open_worksheet
+from report import build_report
+from reference_data import read_reference_csv, load_snapshot, ReferenceDataError, SIZE_TABLE_FILE, PRODUCT_MAPPING_FILE, BREAST_ATTR_FILE, URL_FILE
 
 # --- 1. 初始化設定 ---
 st.set_page_config(page_title="黛莉貝爾智能美體系統", layout="wide")
 
 # 初始化 session_state
 if 'f_name' not in st.session_state: st.session_state['f_name'] = ""
+if 'customer_name' not in st.session_state: st.session_state['customer_name'] = ""
 if 'f_upper' not in st.session_state: st.session_state['f_upper'] = 82.0
 if 'f_lower' not in st.session_state: st.session_state['f_lower'] = 65.0
 if 'f_lsn' not in st.session_state: st.session_state['f_lsn'] = 20.0
@@ -25,38 +30,107 @@ if 'f_tags' not in st.session_state: st.session_state['f_tags'] = []
 if 'f_attr' not in st.session_state: st.session_state['f_attr'] = "不確定胸型" 
 if 'run_report' not in st.session_state: st.session_state['run_report'] = False
 if 'f_icon_url' not in st.session_state: st.session_state['f_icon_url'] = "" 
+if 'f_tid' not in st.session_state: st.session_state['f_tid'] = ""
 
 # TG3D API 設定
 APIKEY = st.secrets.get("APIKEY", "請在secrets設定APIKEY")
-BASE_URL = 'https://api.tg3ds.com/api/v1'
-
-# 身形標籤過濾清單與胸型對應清單
+TG3D_BASE_URL = st.secrets.get("TG3D_BASE_URL", BASE_URL)  # 壓測時可指向本機替身 (mock_tg3d_server.py)
+# TG3D 每秒請求上限 (整個程序共用；0 或未設定則不限，只受 20 條連線限制) 與瞬間可用的請求數
+TG3D_RATE = float(st.secrets.get("TG3D_RATE", 0) or 0)
+TG3D_BURST = int(st.secrets.get("TG3D_BURST", 20))
+SCAN_INDEX_PATH = 'tg3d_scan_index.sqlite3'
+TG3D_CACHE_PATH = 'tg3d_cache.sqlite3'
+# 背景輪詢新掃描的間隔秒數 (0 或未設定則不啟用)；啟用時側邊欄會列出最近幾筆掃描
+SCAN_POLL_INTERVAL = float(st.secrets.get("SCAN_POLL_INTERVAL", 0) or 0)
+RECENT_SCANS = 8
+
+# Google Sheets 紀錄設定
+SHEET_ID = "1xPimP10ko80GBCRLNaLItPsltKCagSo8l_DAFrmf-kQ"
+GSHEETS_SPOOL_PATH = 'gsheets_spool.sqlite3'
+EMAIL_OUTBOX_PATH = 'email_outbox.sqlite3'
+IMAGE_CACHE_DIR = '.image_cache'
+
+# 效能統計：METRICS_LOG 逐筆寫入 JSON lines；METRICS_PORT 開啟 Prometheus 的 /metrics；ADMIN_PANEL 顯示側邊欄監控面板
+METRICS.log_path = st.secrets.get("METRICS_LOG") or None
+
+# 身形標籤過濾清單 (胸型對應清單 ATTR_OPTIONS 見 catalog.py)
 SHAPE_TAGS = {'Rectangle', 'Inverted Triangle', 'Triangle', 'Hourglass', 'Top Hourglass', 'Oval'}
-ATTR_OPTIONS = ["不確定胸型", "秀氣勻稱型", "自然美感型", "成熟承托型", "氣質柔順型", "渾圓美胸型", "柔潤水滴型"]
 
 # --- 2. 核心功能函數 ---
 
-@st.cache_data
 def load_csv_data(file_name):
-    if not os.path.exists(file_name):
-        current_path = os.path.abspath(os.getcwd())
-        st.error(f"📂 **路徑錯誤**：系統目前在資料夾「`{current_path}`」中找不到檔案 `{file_name}`。請確認執行路徑是否正確。")
-        return None
-        
-    last_error = ""
-    for enc in ['utf-8-sig', 'utf-8', 'cp950', 'big5']:
+    with stage('load_csv_data') as span:
         try:
-            df = pd.read_csv(file_name, encoding=enc)
-            if '對應尺寸群組' in df.columns:
-                df['對應尺寸群組'] = df['對應尺寸群組'].astype(str).str.replace('.', ',', regex=False)
-            return df
-        except Exception as e:
-            last_error = str(e)
-            continue
-            
-    st.error(f"⚠️ **格式錯誤**：讀取 `{file_name}` 失敗！檔案確實存在，但格式或編碼無法解析。\n\n**系統錯誤細節：** {last_error}")
+            return read_reference_csv(file_name)
+        except FileNotFoundError:
+            span.fail('FileNotFoundError')
+            current_path = os.path.abspath(os.getcwd())
+            st.error(f"📂 **路徑錯誤**：系統目前在資料夾「`{current_path}`」中找不到檔案 `{file_name}`。請確認執行路徑是否正確。")
+        except ReferenceDataError as e:
+            span.fail('ReferenceDataError')
+            st.error(f"⚠️ **格式錯誤**：讀取 `{file_name}` 失敗！檔案確實存在，但格式或編碼無法解析。\n\n**系統錯誤細節：** {e}")
     return None
 
+@st.cache_resource
+def get_tg3d_client():
+    # 共用連線池與執行緒池，所有 session 一起受同一個限流器管理；
+    # 回應快取也跨 session 共用 (並寫入檔案)，同一位顧客再次查詢不必重新呼叫 TG3D
+    return TG3DClient(APIKEY, base_url=TG3D_BASE_URL, rate=TG3D_RATE, burst=TG3D_BURST,
+                      cache=TTLCache(path=TG3D_CACHE_PATH))
+
+@st.cache_resource
+def get_scan_index():
+    # 整個程序共用一份索引，跨 session 保留
+    return ScanIndex(SCAN_INDEX_PATH)
+
+@st.cache_resource
+def get_scan_poller(interval):
+    # 整個程序共用一條背景輪詢執行緒，預先下載的量測值存在共用的 TG3D 回應快取
+    return ScanPoller(get_tg3d_client(), get_scan_index(), interval=interval).start()
+
+@st.cache_resource
+def get_reference(version):
+    # 每個尺寸表版本只建一次 (SizeEngine, RecommendationCatalog)，之後每次產生報告都只是索引與字典查詢；
+    # 優先載入預先編譯的快照 (python reference_data.py)，CSV 內容有變時才退回讀取 CSV，不保留 DataFrame
+    with stage('load_reference'):
+        reference = load_snapshot(version)
+        if reference is not None: return reference
+
+        size_table = load_csv_data(version)
+        product_mapping = load_csv_data(PRODUCT_MAPPING_FILE)
+        breast_attr = load_csv_data(BREAST_ATTR_FILE)
+        url_df = load_csv_data(URL_FILE)
+        if size_table is None or product_mapping is None: return None
+        return SizeEngine.from_frame(size_table, version=version), RecommendationCatalog.from_frames(product_mapping, breast_attr, url_df)
+
+@st.cache_data(max_entries=1000, show_spinner=False)
+def get_report(upper, lower, lsn, rsn, attr, version):
+    # 同一組量測值只算一次；姓名、Email 等輸入不影響報告
+    engine, catalog = get_reference(version)
+    with stage('build_report'):
+        return build_report(engine, catalog, upper, lower, lsn, rsn, attr, nearest_k=NEAREST_K)
+
+@st.cache_resource
+def get_sheet_log_queue():
+    # 整個程序共用一條背景寫入佇列與工作表連線
+    service_account_info = dict(st.secrets["gcp_service_account"])
+    return SheetLogQueue(lambda: open_worksheet(service_account_info, SHEET_ID), GSHEETS_SPOOL_PATH)
+
+@st.cache_resource
+def get_email_outbox():
+    # SMTP 主機可在 secrets 覆寫 (例如本機測試用的 SMTP 替身)
+    return EmailOutbox(
+        st.secrets["EMAIL_USER"], st.secrets["EMAIL_PASSWORD"], EMAIL_OUTBOX_PATH,
+        host=st.secrets.get("EMAIL_SMTP_HOST", "smtp.gmail.com"),
+        port=int(st.secrets.get("EMAIL_SMTP_PORT", 587)),
+        starttls=bool(st.secrets.get("EMAIL_STARTTLS", True)),
+    )
+
+@st.cache_resource
+def get_image_cache():
+    # 體態圖磁碟 + 記憶體快取，所有 session 共用
+    return ImageCache(IMAGE_CACHE_DIR)
+
 def close_sidebar():
     components.html(
         """
@@ -68,54 +142,100 @@ def close_sidebar():
         """, height=0,
     )
 
-def send_email(target_email, content):
-    try:
-        SENDER_EMAIL = st.secrets["EMAIL_USER"]
-        SENDER_PASSWORD = st.secrets["EMAIL_PASSWORD"]
-        
-        msg = MIMEMultipart()
-        msg['From'] = f"黛莉貝爾智能導購 <{SENDER_EMAIL}>"
-        msg['To'] = target_email
-        msg['Subject'] = "您的黛莉貝爾專業尺寸建議報告"
-        msg.attach(MIMEText(content, 'plain'))
-
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(SENDER_EMAIL, SENDER_PASSWORD)
-        server.send_message(msg)
-        server.quit()
-        return True
-    except Exception as e:
-        st.error(f"郵件發送失敗，請檢查 Secrets 設定: {e}")
+def load_customer(record, user_data):
+    # 把一筆掃描紀錄的量測值與標籤載入側邊欄 (搜尋與「最近掃描」共用)；量測下載失敗時不動目前的資料，回傳 False
+    client = get_tg3d_client()
+    tid = record.get('tid')
+    nickname = user_data.get('user', {}).get('nick_name') or user_data.get('nickname') or ''
+    original_tags = record.get('tag_list', [])
+
+    # ⭐ I-Pose、A-Pose、紀錄明細同時下載 (背景輪詢預先下載過的直接從快取取得)
+    measurements = client.fetch_measurements(tid)
+    if 'pose_i' in measurements.errors or 'pose_a' in measurements.errors:
+        st.error(f"下載測量數據時發生連線問題: {measurements.errors.get('pose_i') or measurements.errors.get('pose_a')}")
         return False
+    m_i, m_a = measurements.pose_i, measurements.pose_a
+    st.session_state['f_icon_url'] = measurements.icon_url
+    st.session_state['f_tid'] = str(tid)
+
+    cleaned_tags = [t for t in original_tags if t not in SHAPE_TAGS]
+    final_tags = cleaned_tags + ["(I-Pose Shape)"]
+
+    matched_attr = "不確定胸型"
+    for tag in original_tags:
+        if tag in ATTR_OPTIONS:
+            matched_attr = tag
+            break
+
+    st.session_state['f_name'] = nickname
+    st.session_state['customer_name'] = nickname
+    st.session_state['f_upper'] = get_tg3d_float(m_i, 'Chest Circumference', 82.0)
+    st.session_state['f_lower'] = get_tg3d_float(m_i, 'F Under Bust Circumference B', 65.0)
+    st.session_state['f_lsn'] = get_tg3d_float(m_a, 'NSP to Apex Length (Left)', 20.0)
+    st.session_state['f_rsn'] = get_tg3d_float(m_a, 'NSP to Apex Length (Right)', 20.0)
+    st.session_state['f_tags'] = final_tags
+    st.session_state['f_attr'] = matched_attr
+
+    st.session_state['run_report'] = True
+    return True
+
+def send_email(target_email, content):
+    with stage('send_email') as span:
+        try:
+            # ⭐ 只放進寄件匣，由背景執行緒用同一條 SMTP 連線寄出
+            get_email_outbox().enqueue(target_email, "您的黛莉貝爾專業尺寸建議報告", content)
+            return True
+        except Exception as e:
+            span.fail(type(e).__name__)
+            st.error(f"郵件發送失敗，請檢查 Secrets 設定: {e}")
+            return False
 
 def save_log_to_gsheets(name, email, upper, lower, left_sn, right_sn, attr, recommended_info):
-    try:
-        scopes = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
-        credentials = Credentials.from_service_account_info(st.secrets["gcp_service_account"], scopes=scopes)
-        gc = gspread.authorize(credentials)
-        SHEET_ID = "1xPimP10ko80GBCRLNaLItPsltKCagSo8l_DAFrmf-kQ" 
-        sh = gc.open_by_key(SHEET_ID)
-        worksheet = sh.sheet1 
-        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        row_data = [
-            current_time, name if name else "未提供", email if email else "未提供", 
-            upper, lower, left_sn, right_sn, attr, recommended_info
-        ]
-        worksheet.append_row(row_data)
-        return True
-    except Exception as e:
-        st.error(f"⚠️ 寫入 Google Sheets 失敗： {e}")
-        return False
+    with stage('save_log_to_gsheets') as span:
+        try:
+            current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            row_data = [
+                current_time, name if name else "未提供", email if email else "未提供", 
+                upper, lower, left_sn, right_sn, attr, recommended_info
+            ]
+            # ⭐ 只寫入本機暫存佇列，由背景執行緒批次送到 Google Sheets，櫃台不用等
+            get_sheet_log_queue().enqueue(row_data)
+            return True
+        except Exception as e:
+            span.fail(type(e).__name__)
+            st.error(f"⚠️ 寫入 Google Sheets 失敗： {e}")
+            return False
 
-def get_tg3d_float(data, key, default_val):
-    if not data: return default_val
-    item = data.get(key)
-    val = item.get('value') if isinstance(item, dict) else item
-    try:
-        return float(val)
-    except (ValueError, TypeError):
-        return default_val
+@st.fragment
+def customer_info():
+    # 姓名與 Email 只在結帳時使用：輸入時只重跑這一段，不會重算或重畫推薦方案
+    st.header("👤 顧客資訊")
+    st.text_input("姓名", key='customer_name', placeholder="請輸入姓名 (選填)")
+    st.text_input("📧 接收 Email", key='customer_email', placeholder="example@mail.com (選填)")
+
+@st.fragment
+def checkout_section(report):
+    # 終極防護：把儲存與 Email 動作包裝在按鈕裡；按下時只重跑這一段
+    st.markdown("---")
+    st.subheader("📤 結帳與後續服務")
+
+    if st.button("💾 確認推薦並儲存至雲端 (若有填寫Email則一併寄出)", type="primary"):
+        user_name = st.session_state.get('customer_name', '')
+        user_email = st.session_state.get('customer_email', '')
+        save_status = save_log_to_gsheets(user_name, user_email, report.upper, report.lower, report.lsn, report.rsn, report.attr, report.log_text)
+
+        if user_email and save_status:
+            if send_email(user_email, report.email_body(user_name)):
+                st.success(f"🎉 報告已排入寄送佇列，將於背景寄送至 {user_email}！")
+        elif not user_email and save_status:
+            st.success("✅ 紀錄已送出，系統將於背景寫入雲端。 (因未填寫 Email，故未寄送報告)")
+
+@st.cache_resource
+def start_metrics_server(port):
+    return METRICS.start_http_server(port)
+
+if st.secrets.get("METRICS_PORT"):
+    start_metrics_server(int(st.secrets["METRICS_PORT"]))
 
 # --- 3. 介面樣式 ---
 st.markdown("""
@@ -163,101 +283,50 @@ with st.sidebar:
         if not search_keyword.strip():
             st.warning("請先輸入關鍵字！")
         else:
-            with st.spinner("🚀 啟動多執行緒加速搜尋中... (可瞬間比對近期 500 筆紀錄)"):
-                found = False
-                checked_users = {} 
+            with st.spinner("🚀 同步 TG3D 掃描索引中... (只下載上次之後的新紀錄)"):
+                client = get_tg3d_client()
+                scan_index = get_scan_index()
                 my_bar = st.progress(0, text="準備連線至 TG3D 雲端...")
 
-                # ⭐ 擴大搜尋到前 500 筆，因為速度已經提上來了！
-                for offset in [0, 100, 200, 300, 400]:
-                    if found: break 
-                    url_records = f'{BASE_URL}/scan_records?apikey={APIKEY}&limit=100&offset={offset}'
-                    try:
-                        resp_records = requests.get(url_records, timeout=10)
-                        if resp_records.status_code != 200: continue 
-                        records = resp_records.json().get('records', [])
-                        
-                        my_bar.progress((offset + 50) / 500, text=f"⚡ 正在批次掃描第 {offset} ~ {offset+100} 筆...")
-
-                        # 1. 抓出這 100 筆裡面「還沒查過」的獨立用戶 ID
-                        unique_uids = list(set([r.get('user_id') for r in records if r.get('user_id') and r.get('user_id') not in checked_users]))
-
-                        # 2. 定義單兵查詢動作
-                        def fetch_user_info(uid):
-                            try:
-                                res = requests.get(f'{BASE_URL}/users/{uid}?apikey={APIKEY}', timeout=5)
-                                if res.status_code == 200:
-                                    return uid, res.json()
-                            except:
-                                pass
-                            return uid, None
-
-                        # 3. ⭐ 多執行緒併發處理 (同時派 20 個人出去問，速度提升 20 倍！)
-                        if unique_uids:
-                            with concurrent.futures.ThreadPoolExecutor(max_workers=20) as executor:
-                                results = executor.map(fetch_user_info, unique_uids)
-                                for uid, data in results:
-                                    if data:
-                                        checked_users[uid] = data
-
-                        # 4. 快取已建立，瞬間秒速比對帳號
-                        for record in records:
-                            user_id = record.get('user_id')
-                            if not user_id or user_id not in checked_users: continue
-                            
-                            user_data = checked_users[user_id]
-                            username = user_data.get('user', {}).get('username', '')
-
-                            if username and str(search_keyword) in str(username):
-                                found = True
-                                my_bar.progress(100, text="✅ 命中目標！正在下載體態圖與精確數值...")
-                                
-                                tid = record.get('tid')
-                                nickname = user_data.get('user', {}).get('nick_name') or user_data.get('nickname') or ''
-                                original_tags = record.get('tag_list', [])
-                                
-                                m_i = requests.get(f'{BASE_URL}/scan_records/{tid}/size_xt?apikey={APIKEY}&pose=I', timeout=10).json().get('measurement', {})
-                                m_a = requests.get(f'{BASE_URL}/scan_records/{tid}/size_xt?apikey={APIKEY}&pose=A', timeout=10).json().get('measurement', {})
-                                
-                                try:
-                                    record_detail = requests.get(f'{BASE_URL}/scan_records/{tid}?apikey={APIKEY}', timeout=10).json()
-                                    st.session_state['f_icon_url'] = record_detail.get('icon_url', '')
-                                except:
-                                    st.session_state['f_icon_url'] = ''
-
-                                cleaned_tags = [t for t in original_tags if t not in SHAPE_TAGS]
-                                final_tags = cleaned_tags + ["(I-Pose Shape)"]
-                                
-                                matched_attr = "不確定胸型"
-                                for tag in original_tags:
-                                    if tag in ATTR_OPTIONS:
-                                        matched_attr = tag
-                                        break
-                                
-                                st.session_state['f_name'] = nickname
-                                st.session_state['f_upper'] = get_tg3d_float(m_i, 'Chest Circumference', 82.0)
-                                st.session_state['f_lower'] = get_tg3d_float(m_i, 'F Under Bust Circumference B', 65.0)
-                                st.session_state['f_lsn'] = get_tg3d_float(m_a, 'NSP to Apex Length (Left)', 20.0)
-                                st.session_state['f_rsn'] = get_tg3d_float(m_a, 'NSP to Apex Length (Right)', 20.0)
-                                st.session_state['f_tags'] = final_tags
-                                st.session_state['f_attr'] = matched_attr 
-                                
-                                st.session_state['run_report'] = True 
-                                break # 找到目標，脫離迴圈
-                                
-                    except Exception as e:
-                        st.error(f"搜尋過程中發生連線問題: {e}")
-                        break 
-                        
-                if not found:
+                def show_sync_progress(scanned, new_count):
+                    my_bar.progress(min(0.9, scanned / (scanned + 100)), text=f"⚡ 已比對 {scanned} 筆，新增 {new_count} 筆掃描紀錄...")
+
+                # 1. 增量同步：從最新一筆往回抓，碰到已索引的紀錄就停止 (背景輪詢啟用時通常只需一次請求)
+                try:
+                    scan_index.sync(client, keyword=search_keyword, progress=show_sync_progress)
+                except Exception as e:
+                    st.warning(f"⚠️ 同步 TG3D 雲端時發生連線問題，改用本地索引查詢: {e}")
+
+                # 2. 本地索引瞬間查詢
+                hit = scan_index.lookup(search_keyword)
+                if hit:
+                    my_bar.progress(100, text="✅ 命中目標！正在下載體態圖與精確數值...")
+                    if not load_customer(*hit): my_bar.empty()
+                else:
                     my_bar.empty()
-                    st.error("❌ 已高速搜尋近期 500 筆紀錄，仍查無此帳號。請確認帳號是否正確。")
+                    st.error(f"❌ 已搜尋本地索引共 {scan_index.count()} 筆掃描紀錄，仍查無此帳號。請確認帳號是否正確。")
+
+    # 最近掃描：背景輪詢已預先下載量測值 (⚡)，點一下即可載入
+    if SCAN_POLL_INTERVAL:
+        poller = get_scan_poller(SCAN_POLL_INTERVAL)
+        with st.expander("🕒 最近掃描", expanded=True):
+            if not poller.fresh() and poller.last_error:
+                st.caption(f"⚠️ 暫時無法連線 TG3D，清單可能不是最新: {poller.last_error}")
+            recent = poller.recent(RECENT_SCANS)
+            if not recent:
+                st.caption("尚無掃描紀錄")
+            for record, user_data in recent:
+                user_obj = (user_data or {}).get('user', {})
+                who = user_obj.get('nick_name') or user_obj.get('username') or f"用戶 {record.get('user_id')}"
+                when = str(record.get('created_at') or '')[11:16]
+                label = f"{'⚡' if poller.is_warm(record['tid']) else '⏳'} {who} {when}".strip()
+                if st.button(label, key=f"recent_{record['tid']}", use_container_width=True):
+                    with st.spinner("正在載入量測數據..."):
+                        load_customer(record, user_data or {})
 
     st.divider()
 
-    st.header("👤 顧客資訊")
-    user_name = st.text_input("姓名", value=st.session_state['f_name'], placeholder="請輸入姓名 (選填)") 
-    user_email = st.text_input("📧 接收 Email", placeholder="example@mail.com (選填)")
+    customer_info()
 
     st.header("📏 數據測量")
     upper_chest = st.number_input("上胸圍 (cm)", 50.0, 150.0, float(st.session_state['f_upper']), 0.1)
@@ -272,29 +341,39 @@ with st.sidebar:
     if st.button("✨ 手動生成報告", use_container_width=True):
         st.session_state['run_report'] = True
 
+    if st.secrets.get("ADMIN_PANEL", False):
+        with st.expander("📊 系統效能監控"):
+            snapshot = METRICS.snapshot()
+            if snapshot:
+                st.dataframe([
+                    {'階段': name, '次數': s['count'], '筆數': s['items'], '平均(ms)': s['avg_ms'], '最長(ms)': s['max_ms'],
+                     '錯誤': '、'.join(f"{k}×{v}" for k, v in s['errors'].items())}
+                    for name, s in snapshot.items()
+                ], hide_index=True)
+            else:
+                st.caption("尚無統計資料")
+            tg3d_cache = get_tg3d_client().cache
+            if tg3d_cache is not None:
+                st.caption("TG3D 回應快取 (命中 / 未命中)")
+                st.json(tg3d_cache.stats())
+            st.code(METRICS.render_prometheus(), language="text")
+
 # --- 5. 主要運算邏輯 (主畫面顯示區) ---
 st.title("𝒟𝒶𝒾𝓁𝓎𝒷𝑒𝓁𝓁𝑒 專業尺寸建議系統")
 
-SELECTED_FILE = "調整尺寸_2.58版.csv"
-
-# 依序讀取檔案
-size_table = load_csv_data(SELECTED_FILE)
-product_mapping = load_csv_data('商品對應尺寸表.csv')
-breast_attr = load_csv_data('胸型屬性.csv')
-url_df = load_csv_data('款式官網連結.csv')
+SELECTED_FILE = SIZE_TABLE_FILE
+NEAREST_K = 3  # 查無符合尺寸時列出幾個最接近的尺寸
 
-url_dict = pd.Series(url_df.官網連結.values, index=url_df.款式號碼.astype(str)).to_dict() if url_df is not None else {}
+# 載入尺寸表與商品目錄 (快照或 CSV)
+reference = get_reference(SELECTED_FILE)
 
-if size_table is not None and product_mapping is not None:
+if reference is not None:
     if st.session_state.get('run_report', False):
         close_sidebar()
         
-        matches = size_table[
-            (size_table['上胸圍1'] <= upper_chest) & (size_table['上胸圍2'] >= upper_chest) &
-            (size_table['下胸圍1'] <= lower_chest) & (size_table['下胸圍2'] >= lower_chest)
-        ]
-        
-        if not matches.empty:
+        report = get_report(upper_chest, lower_chest, left_shoulder_nipple, right_shoulder_nipple, selected_attr, SELECTED_FILE)
+
+        if report.matched:
             st.success(f"✅ 計算完成！根據上胸圍 **{upper_chest}** cm / 下胸圍 **{lower_chest}** cm 為您推薦以下尺寸：")
             
             if st.session_state['f_tags']:
@@ -302,31 +381,12 @@ if size_table is not None and product_mapping is not None:
                 st.markdown(f"#### 📌 雲端判定標籤： **{tags_text}**")
                 st.write("") 
             
-            email_body = f"【黛莉貝爾建議報表】\n"
-            if user_name: email_body += f"親愛的 {user_name} 您好：\n\n"
-            email_body += f"測量數據：\n  - 上胸圍 {upper_chest} cm / 下胸圍 {lower_chest} cm\n  - 頸肩-乳尖(左) {left_shoulder_nipple} cm / 頸肩-乳尖(右) {right_shoulder_nipple} cm\n判定屬性：{selected_attr}\n\n"
-            
-            attr_products = []
-            if selected_attr != "不確定胸型" and breast_attr is not None:
-                attr_products = breast_attr[breast_attr['胸型屬性'] == selected_attr]['款式代號'].astype(str).tolist()
-
-            log_recommend_str = "" 
-            for i, (_, row) in enumerate(matches.iterrows()):
-                group_name = str(row['對應尺寸群組']) 
-                size_label = row['對應尺寸請使用.號隔開']
-                
-                all_group_products = product_mapping[product_mapping['對應尺寸群組'].astype(str) == group_name]['款式代號'].astype(str).unique().tolist()
-                final_products = all_group_products if selected_attr == "不確定胸型" else [p for p in all_group_products if p in attr_products]
-                
-                if final_products:
-                    log_recommend_str += f"[方案{i+1}: 尺寸{size_label}, 款式:{'/'.join(final_products)}] "
-                    with st.expander(f"方案 {i+1}：建議尺寸 {size_label} (群組 {group_name})", expanded=True):
-                        email_body += f"方案 {i+1}：{size_label} (群組 {group_name})\n建議款式：{', '.join(final_products)}\n\n"
-                        cols = st.columns(4)
-                        for idx, p in enumerate(final_products):
-                            url = url_dict.get(p)
-                            display_text = f"[**{p}**]({url})" if url else f"**{p}**"
-                            cols[idx % 4].markdown(f"{display_text}\n\n尺寸：{size_label}")
+            for plan in report.plans:
+                with st.expander(f"方案 {plan.number}：建議尺寸 {plan.label} (群組 {plan.group})", expanded=True):
+                    cols = st.columns(4)
+                    for idx, (p, url) in enumerate(zip(plan.products, plan.urls)):
+                        display_text = f"[**{p}**]({url})" if url else f"**{p}**"
+                        cols[idx % 4].markdown(f"{display_text}\n\n尺寸：{plan.label}")
             
             # 體態圖與下載按鈕
             st.markdown("---")
@@ -335,9 +395,12 @@ if size_table is not None and product_mapping is not None:
             if icon_url:
                 img_col, _ = st.columns([1, 2])
                 with img_col:
-                    st.image(icon_url, use_container_width=True)
-                    try:
-                        img_content = requests.get(icon_url).content
+                    # ⭐ 圖片走快取：重跑畫面時不再重新下載原圖
+                    image_cache = get_image_cache()
+                    tid = st.session_state.get('f_tid') or None
+                    st.image(image_cache.thumbnail(icon_url, key=tid) or icon_url, use_container_width=True)
+                    img_content = image_cache.get(icon_url, key=tid)
+                    if img_content:
                         st.download_button(
                             label="💾 下載正面圖",
                             data=img_content,
@@ -345,27 +408,27 @@ if size_table is not None and product_mapping is not None:
                             mime="image/jpeg",
                             use_container_width=True
                         )
-                    except:
+                    else:
                         st.caption("暫時無法提供下載")
             else:
                 st.info("ℹ️ 尚未載入數據或無圖片")
 
-            # 終極防護：把儲存與 Email 動作包裝在按鈕裡
-            st.markdown("---")
-            st.subheader("📤 結帳與後續服務")
-            
-            if st.button("💾 確認推薦並儲存至雲端 (若有填寫Email則一併寄出)", type="primary"):
-                save_status = save_log_to_gsheets(user_name, user_email, upper_chest, lower_chest, left_shoulder_nipple, right_shoulder_nipple, selected_attr, log_recommend_str)
-                
-                if user_email and save_status:
-                    with st.spinner('正在為您生成並寄送報告中...'):
-                        if send_email(user_email, email_body):
-                            st.success(f"🎉 報告已成功寄送至 {user_email}！")
-                elif not user_email and save_status:
-                    st.success("✅ 紀錄已成功儲存至雲端。 (因未填寫 Email，故未寄送報告)")
+            checkout_section(report)
 
         else:
-            st.warning("⚠️ 查無匹配數據，請嘗試手動微調測量值。")
+            # 沒有任何區間命中：一次列出最接近的尺寸與差距，不必反覆微調數值重跑
+            st.warning("⚠️ 查無完全符合的尺寸，以下為最接近的尺寸 (依差距排序)，請確認測量值後參考：")
+            if abs(left_shoulder_nipple - right_shoulder_nipple) >= ASYMMETRY_CM:
+                st.caption(f"左右頸肩-乳尖相差 {abs(left_shoulder_nipple - right_shoulder_nipple):.1f} cm，差距相同時優先較大的罩杯。")
+            size_engine = reference[0]
+            for plan in report.plans:
+                near = report.nearest[plan.number - 1]
+                with st.expander(f"近似 {plan.number}：{plan.label} (群組 {plan.group})，相差 {near.distance} cm", expanded=plan.number == 1):
+                    st.caption(f"上胸圍 {size_engine.upper_lo[near.row]:g}–{size_engine.upper_hi[near.row]:g} cm / 下胸圍 {size_engine.lower_lo[near.row]:g}–{size_engine.lower_hi[near.row]:g} cm")
+                    cols = st.columns(4)
+                    for idx, (p, url) in enumerate(zip(plan.products, plan.urls)):
+                        display_text = f"[**{p}**]({url})" if url else f"**{p}**"
+                        cols[idx % 4].markdown(f"{display_text}\n\n尺寸：{plan.label}")
 
 st.markdown("---")
 st.caption("© 黛莉貝爾 Daily Belle - 專業美體系統 V5.2 (高速快取版)")
\ No newline at end of file
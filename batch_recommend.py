@@ -0,0 +1,165 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from catalog import ATTR_OPTIONS, UNKNOWN_ATTR
+from reference_data import load_reference, SIZE_TABLE_FILE
+from scan_index import PAGE_SIZE
+from tg3d_client import TG3DClient, TG3DError, get_tg3d_float
+
+# --- 批次推薦 (不需 Streamlit) ---
+# 與 app.py 使用同一套 SizeEngine / RecommendationCatalog，
+# 適合尺寸表改版時，一次把所有舊顧客重新跑一遍推薦。
+#
+#   python batch_recommend.py customers.csv -o 推薦結果.csv
+#   python batch_recommend.py --since 2026-01-01 --until 2026-03-31 -o 推薦結果.csv   (需設定環境變數 TG3D_APIKEY)
+
+COL_UPPER, COL_LOWER = '上胸圍', '下胸圍'
+COL_LSN, COL_RSN = '頸肩-乳尖(左)', '頸肩-乳尖(右)'
+COL_ATTR = '胸型屬性'
+OUTPUT_COLUMNS = ['方案', '尺寸代號', '建議尺寸', '尺寸群組', '建議款式']
+
+# TG3D 掃描紀錄中代表掃描時間的欄位 (依序嘗試)
+SCAN_TIME_KEYS = ('created_at', 'scan_time', 'created')
+
+
+def recommend_frame(engine, catalog, df):
+    # 每位顧客每個方案一列；沒有任何方案的顧客保留一列空白結果，方便後續比對
+    upper = pd.to_numeric(df[COL_UPPER], errors='coerce').to_numpy(dtype=float)
+    lower = pd.to_numeric(df[COL_LOWER], errors='coerce').to_numpy(dtype=float)
+    if COL_ATTR in df.columns:
+        attrs = df[COL_ATTR].fillna(UNKNOWN_ATTR).astype(str).to_numpy()
+    else:
+        attrs = np.full(len(df), UNKNOWN_ATTR, dtype=object)
+
+    res = engine.lookup_many(upper, lower)
+    # query 已排序：同一位顧客的第幾個命中就是方案編號 (與 app.py 相同，無款式的尺寸不列出但保留編號)
+    number = np.arange(len(res.query)) - np.searchsorted(res.query, res.query, side='left') + 1
+    products = [catalog.products(group, attrs[q])[0] for group, q in zip(res.group, res.query)]
+    keep = np.fromiter((bool(p) for p in products), dtype=bool, count=len(products))
+
+    matched = df.iloc[res.query[keep]].reset_index(drop=True)
+    matched['方案'] = number[keep]
+    matched['尺寸代號'] = res.code[keep]
+    matched['建議尺寸'] = res.label[keep]
+    matched['尺寸群組'] = res.group[keep]
+    matched['建議款式'] = ['/'.join(p) for p, k in zip(products, keep) if k]
+    matched['_pos'] = res.query[keep]
+
+    unmatched_pos = np.setdiff1d(np.arange(len(df)), res.query[keep])
+    unmatched = df.iloc[unmatched_pos].reset_index(drop=True)
+    for col in OUTPUT_COLUMNS:
+        unmatched[col] = None
+    unmatched['_pos'] = unmatched_pos
+
+    out = pd.concat([matched, unmatched], ignore_index=True)
+    out = out.sort_values(['_pos', '方案'], kind='stable', na_position='last')
+    return out.drop(columns='_pos')
+
+
+def iter_file_chunks(path, chunksize, encoding):
+    if path.lower().endswith('.parquet'):
+        import pyarrow.parquet as pq  # 只有讀 Parquet 時才需要 pyarrow
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunksize, encoding=encoding)
+
+
+def scan_time(record):
+    for key in SCAN_TIME_KEYS:
+        if record.get(key): return str(record[key])
+    raise TG3DError(f"掃描紀錄 {record.get('tid')} 缺少時間欄位 ({', '.join(SCAN_TIME_KEYS)})")
+
+
+def iter_tg3d_chunks(client, since, until):
+    # 紀錄由新到舊排列：早於 since 就停止翻頁；每一頁的量測數據併發下載
+    offset = 0
+    while True:
+        records = client.list_scan_records(limit=PAGE_SIZE, offset=offset)
+        if not records: return
+        page, reached_since = [], False
+        for record in records:
+            day = scan_time(record)[:10]
+            if until and day > until: continue
+            if since and day < since:
+                reached_since = True
+                break
+            if record.get('tid') is not None: page.append(record)
+
+        if page:
+            def fetch(args):
+                try:
+                    return client.get_size_xt(*args)
+                except TG3DError:
+                    return {}
+            jobs = [(r['tid'], pose) for r in page for pose in ('I', 'A')]
+            results = list(client.executor.map(fetch, jobs))
+            rows = []
+            for i, record in enumerate(page):
+                m_i, m_a = results[2 * i], results[2 * i + 1]
+                tags = record.get('tag_list') or []
+                rows.append({
+                    'tid': record['tid'],
+                    'user_id': record.get('user_id'),
+                    '掃描時間': scan_time(record),
+                    COL_UPPER: get_tg3d_float(m_i, 'Chest Circumference', np.nan),
+                    COL_LOWER: get_tg3d_float(m_i, 'F Under Bust Circumference B', np.nan),
+                    COL_LSN: get_tg3d_float(m_a, 'NSP to Apex Length (Left)', np.nan),
+                    COL_RSN: get_tg3d_float(m_a, 'NSP to Apex Length (Right)', np.nan),
+                    COL_ATTR: next((t for t in tags if t in ATTR_OPTIONS), UNKNOWN_ATTR),
+                })
+            yield pd.DataFrame(rows)
+
+        if reached_since or len(records) < PAGE_SIZE: return
+        offset += PAGE_SIZE
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="黛莉貝爾批次尺寸推薦")
+    parser.add_argument('input', nargs='?', help="顧客清單 (CSV 或 Parquet)，欄位：上胸圍、下胸圍、頸肩-乳尖(左)、頸肩-乳尖(右)、胸型屬性")
+    parser.add_argument('-o', '--output', required=True, help="輸出 CSV 路徑")
+    parser.add_argument('--size-table', default=SIZE_TABLE_FILE, help="尺寸表檔名 (預設 %(default)s)")
+    parser.add_argument('--data-dir', default='.', help="參考資料表所在資料夾")
+    parser.add_argument('--chunksize', type=int, default=50000)
+    parser.add_argument('--encoding', default='utf-8-sig', help="輸入 CSV 編碼")
+    parser.add_argument('--since', help="改從 TG3D 讀取此日期 (含) 之後的掃描，格式 YYYY-MM-DD")
+    parser.add_argument('--until', help="TG3D 掃描的結束日期 (含)")
+    args = parser.parse_args(argv)
+
+    if bool(args.input) == bool(args.since or args.until):
+        parser.error("請擇一指定顧客清單檔案，或 --since/--until 日期範圍")
+
+    engine, catalog = load_reference(args.size_table, base_dir=args.data_dir)
+
+    client = None
+    if args.input:
+        chunks = iter_file_chunks(args.input, args.chunksize, args.encoding)
+    else:
+        apikey = os.environ.get('TG3D_APIKEY')
+        if not apikey:
+            parser.error("請設定環境變數 TG3D_APIKEY")
+        client = TG3DClient(apikey)
+        chunks = iter_tg3d_chunks(client, args.since, args.until)
+
+    started = time.perf_counter()
+    customers = rows = 0
+    try:
+        for i, chunk in enumerate(chunks):
+            out = recommend_frame(engine, catalog, chunk)
+            out.to_csv(args.output, mode='w' if i == 0 else 'a', header=(i == 0), index=False,
+                       encoding='utf-8-sig' if i == 0 else 'utf-8')
+            customers += len(chunk)
+            rows += len(out)
+            print(f"⚡ 已處理 {customers} 位顧客，輸出 {rows} 筆方案", file=sys.stderr)
+    finally:
+        if client: client.close()
+
+    print(f"✅ 完成：{customers} 位顧客 / {rows} 筆 ({time.perf_counter() - started:.2f} 秒，尺寸表 {engine.version})", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,110 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from mock_tg3d_server import MockTG3DServer
+from scan_index import ScanIndex
+from tg3d_client import TG3DClient
+
+# --- 搜尋流程基準測試 ---
+# 對本機 TG3D 替身執行與 app.py 相同的查詢流程 (索引同步 → 本地查詢 → 下載量測)，
+# 報告各情境的牆鐘時間、請求數與 p50 / 最慢一次的延遲，方便逐版比較。
+# TG3DClient 的限流設定與 app.py 相同 (--rate / --burst 對應 secrets 的 TG3D_RATE / TG3D_BURST)。
+#
+#   python bench_search.py --records 1000 --latency 0.05 --repeat 10 --json bench.json
+
+CASES = {
+    'first_page': 5,        # 目標在第一頁
+    'record_450': 450,      # 目標在第 450 筆
+    'not_found': None,      # 查無此帳號
+}
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def run_search(server, keyword, index_path, warm=False, rate=None, burst=20):
+    # 一次完整的查詢；warm=False 代表冷啟動 (空索引、空快取)
+    if not warm and os.path.exists(index_path): os.remove(index_path)
+    client = TG3DClient('bench', base_url=server.base_url, rate=rate, burst=burst)
+    try:
+        index = ScanIndex(index_path)
+        server.reset_counts()
+        started = time.perf_counter()
+        index.sync(client, keyword=keyword)
+        hit = index.lookup(keyword)
+        if hit:
+            client.fetch_measurements(hit[0]['tid'])
+        elapsed = time.perf_counter() - started
+        return elapsed, server.counts['total'], bool(hit)
+    finally:
+        client.close()
+
+
+def run_case(server, name, position, repeat, workdir, warm=False, rate=None, burst=20):
+    keyword = server.username_at(position) if position is not None else 'no-such-user'
+    index_path = os.path.join(workdir, f'{name}.sqlite3')
+    if warm: run_search(server, keyword, index_path, rate=rate, burst=burst)  # 先建好索引，之後只做增量
+    timings, requests_made = [], []
+    found = None
+    for _ in range(repeat):
+        elapsed, count, found = run_search(server, keyword, index_path, warm=warm, rate=rate, burst=burst)
+        timings.append(elapsed)
+        requests_made.append(count)
+    return {
+        'case': name + ('_warm' if warm else ''),
+        'found': found,
+        'wall_s': round(sum(timings), 4),
+        'requests': round(statistics.mean(requests_made), 1),
+        'p50_ms': round(percentile(timings, 0.50) * 1000, 1),
+        'max_ms': round(max(timings) * 1000, 1),  # 每個情境只有 repeat 次樣本，不估算 p99
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TG3D 搜尋流程基準測試")
+    parser.add_argument('--records', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.05, help="替身伺服器每次呼叫延遲 (秒)")
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--rate', type=float, default=0.0, help="TG3D 每秒請求上限，同 app.py 的 TG3D_RATE (0 = 不限)")
+    parser.add_argument('--burst', type=int, default=20, help="同 app.py 的 TG3D_BURST")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', help="另存結果 (JSON lines)，方便版本間比較")
+    args = parser.parse_args(argv)
+
+    server = MockTG3DServer(records=args.records, latency=args.latency, jitter=args.jitter,
+                            error_rate=args.error_rate, throttle_rate=args.throttle_rate).start()
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            for name, position in CASES.items():
+                for warm in (False, True):
+                    results.append(run_case(server, name, position, args.repeat, workdir, warm=warm,
+                                            rate=args.rate or None, burst=args.burst))
+    finally:
+        server.stop()
+
+    print(f"{'情境':<18}{'命中':>6}{'總時間(s)':>12}{'請求數':>10}{'p50(ms)':>10}{'max(ms)':>10}")
+    for r in results:
+        print(f"{r['case']:<20}{'✅' if r['found'] else '❌':>5}{r['wall_s']:>12}{r['requests']:>10}{r['p50_ms']:>10}{r['max_ms']:>10}")
+
+    if args.json:
+        meta = {'records': args.records, 'latency': args.latency, 'repeat': args.repeat, 'rate': args.rate or None,
+                'burst': args.burst, 'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+        with open(args.json, 'a', encoding='utf-8') as f:
+            for r in results:
+                f.write(json.dumps(dict(meta, **r), ensure_ascii=False) + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+from collections import namedtuple
+
+# --- 推薦款式目錄 ---
+# 由「商品對應尺寸表」、「胸型屬性」、「款式官網連結」三張表一次建好，
+# 以 (對應尺寸群組, 胸型屬性) 為鍵預先算出有序的款式清單與官網連結，
+# 產生報告時只剩字典查詢，不再做任何 pandas 篩選。
+
+UNKNOWN_ATTR = "不確定胸型"
+ATTR_OPTIONS = [UNKNOWN_ATTR, "秀氣勻稱型", "自然美感型", "成熟承托型", "氣質柔順型", "渾圓美胸型", "柔潤水滴型"]
+
+# number: 方案編號 (與尺寸表命中順序一致)；products 與 urls 一一對應，無連結時為 None
+Plan = namedtuple('Plan', ['number', 'code', 'label', 'group', 'products', 'urls'])
+
+
+class RecommendationCatalog:
+    def __init__(self, group_products, attr_products, urls):
+        # group_products: {群組: 依表格順序、不重複的款式 tuple}
+        # attr_products: {胸型屬性: 款式 frozenset}；urls: {款式: 官網連結}
+        self.group_products = {g: tuple(ps) for g, ps in group_products.items()}
+        self.attr_products = {a: frozenset(ps) for a, ps in attr_products.items()}
+        self.urls = dict(urls)
+        self._entries = {}
+        for group, products in self.group_products.items():
+            self._entries[(group, UNKNOWN_ATTR)] = self._attach_urls(products)
+            for attr, allowed in self.attr_products.items():
+                self._entries[(group, attr)] = self._attach_urls([p for p in products if p in allowed])
+
+    def _attach_urls(self, products):
+        return tuple(products), tuple(self.urls.get(p) for p in products)
+
+    @classmethod
+    def from_frames(cls, product_mapping, breast_attr=None, url_df=None):
+        group_products = {}
+        for group, product in zip(product_mapping['對應尺寸群組'].astype(str), product_mapping['款式代號'].astype(str)):
+            products = group_products.setdefault(group, [])
+            if product not in products: products.append(product)
+
+        attr_products = {}
+        if breast_attr is not None:
+            for attr, product in zip(breast_attr['胸型屬性'], breast_attr['款式代號'].astype(str)):
+                attr_products.setdefault(attr, set()).add(product)
+
+        urls = {}
+        if url_df is not None:
+            for product, url in zip(url_df['款式號碼'].astype(str), url_df['官網連結']):
+                urls[product] = url if isinstance(url, str) and url else None
+        return cls(group_products, attr_products, urls)
+
+    def products(self, group, attr):
+        # 回傳 (款式 tuple, 官網連結 tuple)；未知群組或沒有資料的胸型屬性回傳空清單
+        return self._entries.get((group, attr), ((), ()))
+
+    def plans(self, matches, attr):
+        # matches 為 SizeEngine.lookup 的結果；沒有任何款式的尺寸不列為方案，但保留編號
+        plans = []
+        for i, match in enumerate(matches):
+            products, urls = self.products(match.group, attr)
+            if products:
+                plans.append(Plan(i + 1, match.code, match.label, match.group, products, urls))
+        return plans
@@ -1,15 +1,26 @@
 import streamlit as st
-import requests
-import time
+from tg3d_client import TG3DClient, TG3DError, BASE_URL
 
 # ==========================================
 # 1. 基本與 API 設定
 # ==========================================
 # 透過 st.secrets 讀取 API Key
 APIKEY = st.secrets["APIKEY"] 
-BASE_URL = 'https://api.tg3ds.com/api/v1'
 SHAPE_TAGS = {'Rectangle', 'Inverted Triangle', 'Triangle', 'Hourglass', 'Top Hourglass', 'Oval'}
 
+# 與 app.py 共用同一套連線池、重試與限流設定
+@st.cache_resource
+def get_tg3d_client():
+    return TG3DClient(APIKEY, base_url=st.secrets.get("TG3D_BASE_URL", BASE_URL),
+                      rate=float(st.secrets.get("TG3D_RATE", 0) or 0), burst=int(st.secrets.get("TG3D_BURST", 20)))
+
+# 查詢失敗的用戶視同查無資料
+def fetch_user_info(user_id):
+    try:
+        return get_tg3d_client().get_user(user_id)
+    except TG3DError:
+        return None
+
 # 輔助函式：安全取得數值
 def get_val(data, key):
     if not data: return '無資料'
@@ -43,14 +54,18 @@ if search_clicked:
         st.warning("⚠️ 請先輸入關鍵字！")
     else:
         with st.spinner(f"正在搜尋「{search_keyword}」的資料..."):
-            url_records = f'{BASE_URL}/scan_records?apikey={APIKEY}&limit=20&offset=0'
+            client = get_tg3d_client()
             
             try:
-                resp_records = requests.get(url_records, timeout=10)
-                resp_records.raise_for_status()
-                records = resp_records.json().get('records', [])
+                records = client.list_scan_records(limit=20, offset=0)
                 found_target = False
 
+                # 20 筆紀錄的用戶資料一次併發查詢；依紀錄順序取結果，命中後取消其餘請求
+                user_futures = {}
+                for r in records:
+                    if r.get('user_id') and r['user_id'] not in user_futures:
+                        user_futures[r['user_id']] = client.executor.submit(fetch_user_info, r['user_id'])
+
                 for record in records:
                     user_id = record.get('user_id')
                     tid = record.get('tid')
@@ -58,12 +73,9 @@ if search_clicked:
 
                     if not user_id: continue
 
-                    # 取得用戶詳細資料
-                    url_user = f'{BASE_URL}/users/{user_id}?apikey={APIKEY}'
-                    resp_user = requests.get(url_user, timeout=10)
+                    user_data = user_futures[user_id].result()
                     
-                    if resp_user.status_code == 200:
-                        user_data = resp_user.json()
+                    if user_data:
                         user_obj = user_data.get('user', {})
                         username = user_obj.get('username', '')
 
@@ -87,16 +99,9 @@ if search_clicked:
                             
                             st.divider()
 
-                            # --- 抓取量測數據 ---
-                            measurements = {}
-                            for pose in ['I', 'A']:
-                                url_pose = f'{BASE_URL}/scan_records/{tid}/size_xt?apikey={APIKEY}&pose={pose}'
-                                try:
-                                    m_resp = requests.get(url_pose, timeout=10).json()
-                                    measurements[pose] = m_resp.get('measurement', {})
-                                except Exception:
-                                    measurements[pose] = {}
-                                time.sleep(0.5)
+                            # --- 抓取量測數據 (I-Pose、A-Pose 同時下載) ---
+                            scan = client.fetch_measurements(tid)
+                            measurements = {'I': scan.pose_i, 'A': scan.pose_a}
 
                             # --- 顯示量測數據 (使用 Metric 排版) ---
                             st.subheader("📏 量測數據結果")
@@ -119,6 +124,9 @@ if search_clicked:
                             st.success("✅ 資料讀取完成！")
                             break # 找到目標後停止搜尋
 
+                for future in user_futures.values():
+                    future.cancel()
+
                 if not found_target:
                     st.error(f"❌ 找不到關鍵字「{search_keyword}」的紀錄。請確認帳號是否正確，或該帳號是否在最新的 20 筆紀錄中。")
 
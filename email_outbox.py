@@ -0,0 +1,169 @@
+import logging
+import smtplib
+import sqlite3
+import threading
+import time
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from metrics import stage
+
+# --- Email 寄件匣 ---
+# 報告先寫入本機 SQLite 寄件匣就立即返回；背景執行緒沿用同一條已登入的 SMTP 連線
+# 批次寄出，失敗時退避重試，並記錄每封信的寄送狀態 (pending / sent / failed)。
+# host、port、starttls 可調整，方便在本機用 aiosmtpd 之類的 SMTP 替身測試。
+
+logger = logging.getLogger(__name__)
+
+SENDER_NAME = "黛莉貝爾智能導購"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    to_addr TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    body TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    last_error TEXT NOT NULL DEFAULT '',
+    created_at REAL NOT NULL,
+    sent_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at);
+"""
+
+
+class EmailOutbox:
+    def __init__(self, sender, password, path, host='smtp.gmail.com', port=587, starttls=True,
+                 batch_size=20, poll_interval=1.0, max_attempts=5, backoff=5.0, idle_timeout=60.0):
+        self.sender = sender
+        self.password = password
+        self.path = path
+        self.host = host
+        self.port = port
+        self.starttls = starttls
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.idle_timeout = idle_timeout
+        self._smtp = None
+        self._last_used = 0.0
+        self._wake = threading.Event()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+        self._thread = threading.Thread(target=self._run, name='email-outbox', daemon=True)
+        self._thread.start()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def enqueue(self, to_addr, subject, body):
+        with self._connect() as conn:
+            cur = conn.execute(
+                "INSERT INTO outbox (to_addr, subject, body, created_at) VALUES (?, ?, ?, ?)",
+                (to_addr, subject, body, time.time()),
+            )
+        self._wake.set()
+        return cur.lastrowid
+
+    def status(self, message_id):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT status, attempts, last_error, sent_at FROM outbox WHERE id = ?", (message_id,)
+            ).fetchone()
+        if row is None: return None
+        return {'status': row[0], 'attempts': row[1], 'last_error': row[2], 'sent_at': row[3]}
+
+    def counts(self):
+        with self._connect() as conn:
+            return dict(conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+
+    def flush(self, timeout=30.0):
+        # 等到沒有「已到期」的待寄信件為止；回傳是否已清空
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._connect() as conn:
+                due = conn.execute(
+                    "SELECT COUNT(*) FROM outbox WHERE status = 'pending' AND next_attempt_at <= ?", (time.time(),)
+                ).fetchone()[0]
+            if not due: return True
+            self._wake.set()
+            time.sleep(0.05)
+        return False
+
+    def _build_message(self, to_addr, subject, body):
+        msg = MIMEMultipart()
+        msg['From'] = f"{SENDER_NAME} <{self.sender}>"
+        msg['To'] = to_addr
+        msg['Subject'] = subject
+        msg.attach(MIMEText(body, 'plain'))
+        return msg
+
+    def _server(self):
+        # 沿用已登入的連線；閒置過久的連線由 _run 主動關閉 (Gmail 也會自行斷線)
+        if self._smtp is None:
+            server = smtplib.SMTP(self.host, self.port, timeout=30)
+            if self.starttls: server.starttls()
+            if self.password: server.login(self.sender, self.password)
+            self._smtp = server
+        return self._smtp
+
+    def _close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+        self._smtp = None
+
+    def _mark(self, message_id, attempts, error):
+        # 收件者被拒收、信件本身格式錯誤 (非連線類例外) 之類的永久錯誤直接標為 failed；其餘錯誤退避後重試
+        with self._connect() as conn:
+            if error is None:
+                conn.execute("UPDATE outbox SET status = 'sent', attempts = ?, last_error = '', sent_at = ? WHERE id = ?",
+                             (attempts, time.time(), message_id))
+            elif (isinstance(error, smtplib.SMTPRecipientsRefused) or not isinstance(error, (smtplib.SMTPException, OSError))
+                  or attempts >= self.max_attempts):
+                conn.execute("UPDATE outbox SET status = 'failed', attempts = ?, last_error = ? WHERE id = ?",
+                             (attempts, str(error), message_id))
+            else:
+                conn.execute("UPDATE outbox SET attempts = ?, last_error = ?, next_attempt_at = ? WHERE id = ?",
+                             (attempts, str(error), time.time() + self.backoff * (2 ** (attempts - 1)), message_id))
+
+    def _send_due(self):
+        with self._connect() as conn:
+            batch = conn.execute(
+                "SELECT id, to_addr, subject, body, attempts FROM outbox "
+                "WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+                (time.time(), self.batch_size),
+            ).fetchall()
+        for message_id, to_addr, subject, body, attempts in batch:
+            try:
+                with stage('email_send'):
+                    self._server().send_message(self._build_message(to_addr, subject, body))
+                self._last_used = time.monotonic()
+                self._mark(message_id, attempts + 1, None)
+            except (smtplib.SMTPException, OSError) as e:
+                logger.warning("寄送報告至 %s 失敗 (第 %d 次): %s", to_addr, attempts + 1, e)
+                if not isinstance(e, smtplib.SMTPRecipientsRefused): self._close()
+                self._mark(message_id, attempts + 1, e)
+            except Exception as e:
+                # 信件本身有問題 (例如標頭格式錯誤)：重試也不會成功，標為 failed，避免卡住整個寄件匣
+                logger.exception("報告信件 %s 無法寄出", message_id)
+                self._close()
+                self._mark(message_id, attempts + 1, e)
+        return len(batch)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            try:
+                while self._send_due() == self.batch_size:
+                    pass
+            except Exception:
+                logger.exception("寄件匣處理失敗")
+            if self._smtp is not None and time.monotonic() - self._last_used > self.idle_timeout:
+                self._close()
@@ -0,0 +1,99 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from metrics import stage
+
+# --- Google Sheets 背景批次寫入 ---
+# 店員按下儲存時只把資料寫進本機 SQLite 暫存 (重啟也不會遺失)，
+# 背景執行緒再用同一個長期有效的工作表連線，以 append_rows 批次送出。
+# Google 端暫時失敗時會退避重試，櫃台不需要等待。
+
+logger = logging.getLogger(__name__)
+
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
+
+
+def open_worksheet(service_account_info, sheet_id):
+    import gspread
+    from google.oauth2.service_account import Credentials
+    credentials = Credentials.from_service_account_info(service_account_info, scopes=SCOPES)
+    return gspread.authorize(credentials).open_by_key(sheet_id).sheet1
+
+
+class SheetLogQueue:
+    def __init__(self, open_sheet, spool_path, batch_size=50, flush_interval=2.0, max_backoff=300.0):
+        # open_sheet(): 回傳 gspread Worksheet；第一次寫入時才連線，失敗後會重新開啟
+        self.open_sheet = open_sheet
+        self.spool_path = spool_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self.last_error = ""
+        self._worksheet = None
+        self._wake = threading.Event()
+        self._idle = threading.Condition()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS rows (id INTEGER PRIMARY KEY AUTOINCREMENT, data TEXT NOT NULL)")
+        self._thread = threading.Thread(target=self._run, name='gsheets-writer', daemon=True)
+        self._thread.start()
+
+    def _connect(self):
+        return sqlite3.connect(self.spool_path, timeout=30)
+
+    def enqueue(self, row):
+        with self._connect() as conn:
+            conn.execute("INSERT INTO rows (data) VALUES (?)", (json.dumps(row, ensure_ascii=False),))
+        self._wake.set()
+
+    def pending(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM rows").fetchone()[0]
+
+    def flush(self, timeout=30.0):
+        # 等待暫存全部送出；回傳是否已清空
+        deadline = time.monotonic() + timeout
+        self._wake.set()
+        with self._idle:
+            while self.pending():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0: return False
+                self._idle.wait(min(remaining, 0.5))
+        return True
+
+    def _send_batch(self):
+        with self._connect() as conn:
+            batch = conn.execute("SELECT id, data FROM rows ORDER BY id LIMIT ?", (self.batch_size,)).fetchall()
+        if not batch: return 0
+        with stage('gsheets_flush', items=len(batch)):
+            if self._worksheet is None:
+                self._worksheet = self.open_sheet()
+            self._worksheet.append_rows([json.loads(data) for _, data in batch])
+        with self._connect() as conn:
+            conn.execute(f"DELETE FROM rows WHERE id IN ({','.join('?' * len(batch))})", [i for i, _ in batch])
+        return len(batch)
+
+    def _run(self):
+        backoff = 0.0
+        while True:
+            if backoff:
+                time.sleep(backoff)  # 退避期間不理會新的喚醒，避免高峰時每次點擊都重打 Google
+            else:
+                self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                # 一次把暫存清空，每批最多 batch_size 列
+                while self._send_batch() == self.batch_size:
+                    pass
+                backoff = 0.0
+                self.last_error = ""
+            except Exception as e:
+                # 憑證過期、配額或網路問題：丟掉舊連線，下次重新開啟並退避
+                self._worksheet = None
+                self.last_error = str(e)
+                backoff = min(self.max_backoff, max(self.flush_interval, backoff * 2))
+                logger.warning("寫入 Google Sheets 失敗，%.1f 秒後重試: %s", backoff, e)
+            with self._idle:
+                self._idle.notify_all()
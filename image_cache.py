@@ -0,0 +1,144 @@
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+import requests
+
+# --- 體態圖快取 ---
+# 以 tid (沒有 tid 時用圖片網址) 為鍵，記憶體與磁碟兩層 LRU，磁碟總量有上限。
+# 過期後用 ETag / Last-Modified 做條件式請求，沒變就只更新時間戳；
+# 顯示用縮圖只產生一次，Streamlit 重跑時直接回傳快取的位元組。
+
+
+class ImageCache:
+    def __init__(self, cache_dir, max_bytes=200 * 1024 * 1024, memory_items=64, fresh_for=3600,
+                 thumb_size=(480, 480), timeout=10):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self.fresh_for = fresh_for
+        self.thumb_size = thumb_size
+        self.timeout = timeout
+        self.session = requests.Session()
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key, suffix):
+        digest = hashlib.sha1(str(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest + suffix)
+
+    def _remember(self, name, data):
+        with self._lock:
+            self._memory[name] = data
+            self._memory.move_to_end(name)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def _recall(self, name):
+        with self._lock:
+            data = self._memory.get(name)
+            if data is not None: self._memory.move_to_end(name)
+            return data
+
+    def _read_disk(self, path):
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)  # 以修改時間當作最近使用時間
+            return data
+        except OSError:
+            return None
+
+    def _write_disk(self, path, data):
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes: break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def get(self, url, key=None):
+        # 回傳原圖位元組；下載失敗時盡量回傳舊的快取，完全沒有則回傳 None
+        key = key or url
+        image_path, meta_path = self._path(key, '.img'), self._path(key, '.json')
+        meta = {}
+        raw = self._read_disk(meta_path)
+        if raw:
+            try:
+                meta = json.loads(raw)
+            except ValueError:
+                meta = {}
+        data = self._recall(image_path) or (self._read_disk(image_path) if meta else None)
+        if data is not None and time.time() - meta.get('checked_at', 0) < self.fresh_for:
+            self._remember(image_path, data)
+            return data
+
+        headers = {}
+        if data is not None:
+            if meta.get('etag'): headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'): headers['If-Modified-Since'] = meta['last_modified']
+        try:
+            resp = self.session.get(url, headers=headers, timeout=self.timeout)
+        except requests.RequestException:
+            return data
+
+        if resp.status_code == 304 and data is not None:
+            pass
+        elif resp.status_code == 200:
+            data = resp.content
+            meta = {'url': url, 'etag': resp.headers.get('ETag'), 'last_modified': resp.headers.get('Last-Modified')}
+            self._write_disk(image_path, data)
+            # 原圖換了，舊縮圖作廢
+            thumb_path = self._path(key, '.thumb.jpg')
+            with self._lock:
+                self._memory.pop(thumb_path, None)
+            if os.path.exists(thumb_path): os.remove(thumb_path)
+        else:
+            return data
+
+        meta['checked_at'] = time.time()
+        self._write_disk(meta_path, json.dumps(meta).encode('utf-8'))
+        self._remember(image_path, data)
+        self._evict()
+        return data
+
+    def thumbnail(self, url, key=None):
+        # 顯示用縮圖 (JPEG)；沒有安裝 Pillow 或無法解析時退回原圖
+        key = key or url
+        thumb_path = self._path(key, '.thumb.jpg')
+        original = self.get(url, key)
+        if original is None: return None
+        thumb = self._recall(thumb_path) or self._read_disk(thumb_path)
+        if thumb is None:
+            try:
+                from PIL import Image
+                with Image.open(io.BytesIO(original)) as img:
+                    img.thumbnail(self.thumb_size)
+                    buf = io.BytesIO()
+                    img.convert('RGB').save(buf, format='JPEG', quality=85)
+                thumb = buf.getvalue()
+            except Exception:
+                return original
+            self._write_disk(thumb_path, thumb)
+        self._remember(thumb_path, thumb)
+        return thumb
@@ -0,0 +1,365 @@
+import argparse
+import json
+import os
+import random
+import re
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+import gsheets_queue
+from bench_search import percentile
+from mock_tg3d_server import MockTG3DServer
+from reference_data import load_reference
+from scan_index import ScanIndex
+from tg3d_client import TG3DClient
+
+# --- 多櫃台同時操作的壓力測試 ---
+# 以 Streamlit AppTest 在同一個程序內無頭執行 app.py，N 位模擬店員同時各自跑完整流程：
+# 開啟頁面 → 輸入帳號搜尋 → 產生報告 → 填 Email → 儲存並寄送。
+# TG3D、Google Sheets、SMTP 全部換成本機替身；報告吞吐量、各步驟延遲百分位、記憶體與執行緒數。
+#
+#   python loadtest_app.py --clerks 8 --sessions 5 --latency 0.05 --json loadtest.json
+
+APP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+DATA_SUFFIXES = ('.csv', '.pkl', '.png')
+STEPS = ('open', 'search', 'email', 'save')
+SCAN_INDEX_FILE = 'tg3d_scan_index.sqlite3'  # 與 app.py 的 SCAN_INDEX_PATH 相同
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    # 最小的 SMTP 替身：接受任何寄件者與收件者，只計算收到幾封信
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.received = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        super().__init__((host, port), self._handler())
+
+    def _handler(self):
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write(line.encode('ascii') + b'\r\n')
+
+            def handle(self):
+                with server._lock:
+                    server.connections += 1
+                self.reply('220 smtp stand-in ready')
+                while True:
+                    line = self.rfile.readline()
+                    if not line: return
+                    command = line.decode('utf-8', 'replace').strip().upper()
+                    if command.startswith('EHLO'):
+                        self.wfile.write(b'250-stand-in\r\n250 8BITMIME\r\n')
+                    elif command == 'DATA':
+                        self.reply('354 end with <CRLF>.<CRLF>')
+                        while self.rfile.readline() not in (b'.\r\n', b'.\n', b''):
+                            pass
+                        with server._lock:
+                            server.received += 1
+                        self.reply('250 OK')
+                    elif command.startswith('QUIT'):
+                        self.reply('221 bye')
+                        return
+                    else:
+                        self.reply('250 OK')
+
+        return Handler
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='smtp-stand-in', daemon=True).start()
+        return self
+
+
+class SheetStandIn:
+    # 取代 gsheets_queue.open_worksheet 回傳的工作表，只計算寫入列數
+    def __init__(self):
+        self.rows = 0
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def append_rows(self, rows, value_input_option=None):
+        with self._lock:
+            self.rows += len(rows)
+            self.calls += 1
+
+
+def write_secrets(workdir, server, smtp):
+    # 寫成檔案讓所有 session 共用 (AppTest.secrets 會在每次執行時替換全域的 st.secrets，多執行緒下會互相覆蓋)
+    os.makedirs(os.path.join(workdir, '.streamlit'), exist_ok=True)
+    with open(os.path.join(workdir, '.streamlit', 'secrets.toml'), 'w', encoding='utf-8') as f:
+        f.write(f'APIKEY = "loadtest"\n'
+                f'TG3D_BASE_URL = "{server.base_url}"\n'
+                f'EMAIL_USER = "loadtest@example.com"\n'
+                f'EMAIL_PASSWORD = ""\n'
+                f'EMAIL_SMTP_HOST = "127.0.0.1"\n'
+                f'EMAIL_SMTP_PORT = {smtp.port}\n'
+                f'EMAIL_STARTTLS = false\n'
+                f'\n[gcp_service_account]\ntype = "service_account"\n')
+
+
+def patch_apptest_for_threads():
+    # AppTest 原本是給單執行緒測試用的，多位店員同時執行需要三個調整：
+    # 1. 每次執行都會換掉、並在結束時清空全域的 Runtime 單例 → 清空的空檔沿用最近一次的模擬 Runtime
+    # 2. 每次執行都重新解析 app.py，而 ast.parse 在多執行緒下並不安全 → 加鎖 (正式伺服器只解析一次)
+    # 3. 執行期間暫時打開、結束時還原的 global.appTest 設定 → 整個壓測期間保持打開
+    from streamlit import config
+    from streamlit.runtime.runtime import Runtime
+    from streamlit.runtime.scriptrunner import script_cache
+
+    original = Runtime.__dict__['instance'].__func__
+    last = []
+
+    def instance(cls):
+        if cls._instance is not None:
+            last[:] = [cls._instance]
+            return cls._instance
+        return last[0] if last else original(cls)
+
+    Runtime.instance = classmethod(instance)
+
+    add_magic = script_cache.magic.add_magic
+    parse_lock = threading.Lock()
+
+    def locked_add_magic(code, script_path):
+        with parse_lock:
+            return add_magic(code, script_path)
+
+    script_cache.magic.add_magic = locked_add_magic
+    config.set_option('global.appTest', True)
+
+
+def prefill_index(server):
+    # 正式環境的索引早已同步完成；先用不限速的 client 建好，壓測時只測增量同步
+    client = TG3DClient('loadtest', base_url=server.base_url, rate=None)
+    try:
+        ScanIndex(SCAN_INDEX_FILE).sync(client)
+    finally:
+        client.close()
+
+
+def rss_bytes():
+    # 目前的常駐記憶體；沒有 /proc 時退回最高使用量
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def thread_groups():
+    # 依名稱分組 (去掉流水號)，例如 tg3d_3 → tg3d、Thread-12 (process_request_thread) → Thread (process_request_thread)
+    return Counter(re.sub(r'[-_]\d+', '', t.name) for t in threading.enumerate())
+
+
+class Monitor:
+    # 背景取樣執行緒數與記憶體，記錄各組的最高值
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak_threads = 0
+        self.peak_groups = Counter()
+        self.peak_rss = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='loadtest-monitor', daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            groups = thread_groups()
+            self.peak_threads = max(self.peak_threads, sum(groups.values()))
+            for name, n in groups.items():
+                self.peak_groups[name] = max(self.peak_groups[name], n)
+            self.peak_rss = max(self.peak_rss, rss_bytes())
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def clerk_session(keyword, email, timeout):
+    # 一位店員完成一次完整流程；回傳各步驟耗時 (秒)
+    from streamlit.testing.v1 import AppTest
+
+    timings = {}
+
+    def timed(step, action):
+        started = time.perf_counter()
+        result = action()
+        timings[step] = time.perf_counter() - started
+        if result.exception:
+            raise RuntimeError(f"{step}: {result.exception[0].message}")
+        return result
+
+    at = AppTest.from_file(APP_FILE, default_timeout=timeout)
+    timed('open', at.run)
+    at.text_input[0].input(keyword)
+    search = next(b for b in at.button if b.label.startswith('⬇️'))
+    timed('search', search.click().run)
+    if not at.session_state['run_report']:
+        raise RuntimeError(f"search: 查無帳號 {keyword}")
+    timed('email', at.text_input[2].input(email).run)
+    save = next((b for b in at.button if b.label.startswith('💾')), None)
+    if save is None:
+        raise RuntimeError("save: 報告沒有命中任何尺寸，找不到儲存按鈕")
+    timed('save', save.click().run)
+    if not any('寄送' in s.value for s in at.success):
+        raise RuntimeError(f"save: {[e.value for e in at.error]}")
+    return timings
+
+
+def run_load(server, clerks, sessions, timeout=120, seed=0):
+    rng = random.Random(seed)
+    # 只挑量測值落在尺寸表內的顧客，報告才會出現儲存按鈕
+    engine, _ = load_reference(base_dir=os.path.dirname(APP_FILE))
+
+    def in_table(record):
+        pose_i = server.measurement(record['tid'], 'I')
+        return engine.lookup(pose_i['Chest Circumference']['value'], pose_i['F Under Bust Circumference B']['value'])
+
+    positions = [i for i, record in enumerate(server.records) if in_table(record)]
+    jobs = [[server.username_at(rng.choice(positions)) for _ in range(sessions)] for _ in range(clerks)]
+
+    results, errors = [], []
+    lock = threading.Lock()
+
+    def clerk(n):
+        for i, keyword in enumerate(jobs[n]):
+            started = time.perf_counter()
+            try:
+                timings = clerk_session(keyword, f'clerk{n}-{i}@example.com', timeout)
+            except Exception as e:
+                with lock:
+                    errors.append(f"clerk {n} #{i}: {e}")
+                continue
+            timings['session'] = time.perf_counter() - started
+            with lock:
+                results.append(timings)
+
+    threads = [threading.Thread(target=clerk, args=(n,), name=f'clerk-{n}') for n in range(clerks)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, errors, time.perf_counter() - started
+
+
+def wait_for(condition, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition(): return True
+        time.sleep(0.1)
+    return condition()
+
+
+def summarize(results, errors, elapsed, clerks, rss_before, rss_after, monitor, sheet, smtp, drained):
+    done = len(results)
+    summary = {
+        'clerks': clerks,
+        'sessions': done,
+        'errors': len(errors),
+        'wall_s': round(elapsed, 2),
+        'sessions_per_min': round(done / elapsed * 60, 1) if elapsed else 0.0,
+        'rss_start_mb': round(rss_before / 2 ** 20, 1),
+        'rss_peak_mb': round(monitor.peak_rss / 2 ** 20, 1),
+        'rss_per_session_kb': round((rss_after - rss_before) / done / 1024, 1) if done else 0.0,
+        'peak_threads': monitor.peak_threads,
+        'peak_thread_groups': dict(monitor.peak_groups.most_common()),
+        'sheet_rows': sheet.rows, 'sheet_batches': sheet.calls,
+        'emails': smtp.received, 'smtp_connections': smtp.connections,
+        'drained': drained,
+    }
+    for step in STEPS + ('session',):
+        values = [r[step] for r in results if step in r]
+        if values:
+            summary[f'{step}_p50_ms'] = round(percentile(values, 0.50) * 1000, 1)
+            summary[f'{step}_p95_ms'] = round(percentile(values, 0.95) * 1000, 1)
+            summary[f'{step}_max_ms'] = round(max(values) * 1000, 1)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="多櫃台同時操作 app.py 的壓力測試")
+    parser.add_argument('--clerks', type=int, default=4, help="同時操作的店員數")
+    parser.add_argument('--sessions', type=int, default=3, help="每位店員完成幾次完整流程")
+    parser.add_argument('--records', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.05, help="TG3D 替身每次呼叫延遲 (秒)")
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--timeout', type=float, default=120, help="單一步驟的逾時 (秒)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--cold-index', action='store_true', help="不預先建立掃描索引 (模擬新部署的第一批搜尋)")
+    parser.add_argument('--json', help="另存結果 (JSON lines)，方便版本間比較")
+    args = parser.parse_args(argv)
+
+    data_dir = os.path.dirname(APP_FILE)
+    sheet = SheetStandIn()
+    gsheets_queue.open_worksheet = lambda service_account_info, sheet_id: sheet
+    server = MockTG3DServer(records=args.records, latency=args.latency, jitter=args.jitter, seed=args.seed).start()
+    smtp = SMTPStandIn().start()
+    cwd = os.getcwd()
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            # 在暫存資料夾執行，索引、快取、佇列檔案不會碰到正式資料
+            for name in os.listdir(data_dir):
+                if name.endswith(DATA_SUFFIXES):
+                    os.symlink(os.path.join(data_dir, name), os.path.join(workdir, name))
+            os.chdir(workdir)
+            write_secrets(workdir, server, smtp)
+            patch_apptest_for_threads()
+            if not args.cold_index: prefill_index(server)
+
+            # 先跑一次暖機 (載入 Streamlit、參考資料、背景執行緒)，記憶體從暖機後開始算
+            warmup, _, _ = run_load(server, clerks=1, sessions=1, timeout=args.timeout, seed=args.seed + 1)
+            wait_for(lambda: sheet.rows >= len(warmup) and smtp.received >= len(warmup), timeout=30)
+            sheet.rows = sheet.calls = smtp.received = smtp.connections = 0
+            rss_before = rss_bytes()
+            monitor = Monitor().start()
+            results, errors, elapsed = run_load(server, args.clerks, args.sessions, args.timeout, args.seed)
+            drained = wait_for(lambda: sheet.rows >= len(results) and smtp.received >= len(results), timeout=30)
+            monitor.stop()
+            rss_after = rss_bytes()
+            os.chdir(cwd)
+    finally:
+        os.chdir(cwd)
+        server.stop()
+        smtp.shutdown()
+
+    summary = summarize(results, errors, elapsed, args.clerks, rss_before, rss_after, monitor, sheet, smtp, drained)
+    for error in errors[:10]:
+        print(f"❌ {error}", file=sys.stderr)
+    print(f"店員 {args.clerks} 位 / 完成 {summary['sessions']} 次流程 / 失敗 {summary['errors']} 次，"
+          f"總時間 {summary['wall_s']} 秒 ({summary['sessions_per_min']} 次/分)")
+    print(f"{'步驟':<10}{'p50(ms)':>10}{'p95(ms)':>10}{'max(ms)':>10}")
+    for step in STEPS + ('session',):
+        if f'{step}_p50_ms' in summary:
+            print(f"{step:<12}{summary[f'{step}_p50_ms']:>10}{summary[f'{step}_p95_ms']:>10}{summary[f'{step}_max_ms']:>10}")
+    print(f"記憶體：暖機後 {summary['rss_start_mb']} MB，最高 {summary['rss_peak_mb']} MB，每次流程約增加 {summary['rss_per_session_kb']} KB")
+    print(f"執行緒：最高 {summary['peak_threads']} 條 " + '、'.join(f"{k}×{v}" for k, v in summary['peak_thread_groups'].items()))
+    print(f"Sheets 寫入 {summary['sheet_rows']} 列 ({summary['sheet_batches']} 批)；"
+          f"SMTP 收到 {summary['emails']} 封 ({summary['smtp_connections']} 條連線)" + ('' if drained else "；⚠️ 背景佇列未在 30 秒內清空"))
+
+    if args.json:
+        meta = {'records': args.records, 'latency': args.latency, 'cold_index': args.cold_index, 'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+        with open(args.json, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(dict(meta, **summary), ensure_ascii=False) + '\n')
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,124 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# --- 各階段耗時統計 ---
+# 以 `with stage('名稱'):` 包住每個步驟，記錄耗時、處理筆數與錯誤類別；
+# 可輸出 Prometheus 文字格式 (內建 /metrics 小伺服器) 或逐筆寫成 JSON lines。
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Span:
+    def __init__(self, name):
+        self.name = name
+        self.items = 1
+        self.error = None
+
+    def fail(self, category):
+        # 不拋出例外、只回傳失敗的步驟 (例如 st.error 後 return False) 用這個標記錯誤
+        self.error = category
+
+
+class Metrics:
+    def __init__(self, log_path=None):
+        self.log_path = log_path
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, items=1):
+        span = Span(name)
+        span.items = items
+        started = time.perf_counter()
+        try:
+            yield span
+        except Exception as e:
+            span.error = span.error or type(e).__name__
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - started, items=span.items, error=span.error)
+
+    def observe(self, name, seconds, items=1, error=None):
+        with self._lock:
+            s = self._stages.setdefault(name, {
+                'count': 0, 'items': 0, 'seconds': 0.0, 'max': 0.0,
+                'buckets': [0] * len(BUCKETS), 'errors': {},
+            })
+            s['count'] += 1
+            s['items'] += items
+            s['seconds'] += seconds
+            s['max'] = max(s['max'], seconds)
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound: s['buckets'][i] += 1
+            if error: s['errors'][error] = s['errors'].get(error, 0) + 1
+            if self.log_path:
+                event = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'stage': name, 'seconds': round(seconds, 6),
+                         'items': items, 'error': error}
+                with open(self.log_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(event, ensure_ascii=False) + '\n')
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                name: {
+                    'count': s['count'], 'items': s['items'], 'errors': dict(s['errors']),
+                    'avg_ms': round(s['seconds'] / s['count'] * 1000, 1) if s['count'] else 0.0,
+                    'max_ms': round(s['max'] * 1000, 1),
+                }
+                for name, s in sorted(self._stages.items())
+            }
+
+    def render_prometheus(self):
+        lines = [
+            '# HELP dailybelle_stage_seconds 各處理階段耗時 (秒)',
+            '# TYPE dailybelle_stage_seconds histogram',
+        ]
+        with self._lock:
+            stages = sorted((name, dict(s, buckets=list(s['buckets']), errors=dict(s['errors']))) for name, s in self._stages.items())
+        for name, s in stages:
+            for bound, n in zip(BUCKETS, s['buckets']):
+                lines.append(f'dailybelle_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {n}')
+            lines.append(f'dailybelle_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {s["count"]}')
+            lines.append(f'dailybelle_stage_seconds_sum{{stage="{name}"}} {s["seconds"]:.6f}')
+            lines.append(f'dailybelle_stage_seconds_count{{stage="{name}"}} {s["count"]}')
+        lines += ['# HELP dailybelle_stage_items_total 各階段處理的筆數', '# TYPE dailybelle_stage_items_total counter']
+        lines += [f'dailybelle_stage_items_total{{stage="{name}"}} {s["items"]}' for name, s in stages]
+        lines += ['# HELP dailybelle_stage_errors_total 各階段錯誤次數 (依錯誤類別)', '# TYPE dailybelle_stage_errors_total counter']
+        for name, s in stages:
+            for category, n in sorted(s['errors'].items()):
+                lines.append(f'dailybelle_stage_errors_total{{stage="{name}",category="{category}"}} {n}')
+        return '\n'.join(lines) + '\n'
+
+    def start_http_server(self, port, host='0.0.0.0'):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                payload = metrics.render_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        httpd = ThreadingHTTPServer((host, port), Handler)
+        httpd.daemon_threads = True
+        threading.Thread(target=httpd.serve_forever, name='metrics-http', daemon=True).start()
+        return httpd
+
+
+# 程序內共用的預設統計
+METRICS = Metrics()
+
+
+def stage(name, items=1):
+    return METRICS.stage(name, items=items)
@@ -0,0 +1,182 @@
+import argparse
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# --- 本機 TG3D 替身伺服器 ---
+# 模擬 /scan_records、/users/{id}、/scan_records/{tid}/size_xt、/scan_records/{tid}，
+# 可設定紀錄筆數、每次呼叫延遲、錯誤率與 429 比例，供壓測與基準測試使用，不必連線正式的 api.tg3ds.com。
+#
+#   python mock_tg3d_server.py --records 2000 --latency 0.08 --port 8765
+#   (app.py 的 secrets 設定 TG3D_BASE_URL = "http://127.0.0.1:8765/api/v1")
+
+API_PREFIX = '/api/v1'
+ATTR_TAGS = ["秀氣勻稱型", "自然美感型", "成熟承托型", "氣質柔順型", "渾圓美胸型", "柔潤水滴型"]
+SHAPE_TAGS = ['Rectangle', 'Hourglass', 'Triangle']
+
+
+def username_for(user_id):
+    # 固定 8 碼，任一帳號都不會是另一個帳號的子字串
+    return str(26000000 + user_id)
+
+
+class MockTG3DServer:
+    def __init__(self, records=1000, users=None, latency=0.0, jitter=0.0, error_rate=0.0,
+                 throttle_rate=0.0, retry_after=None, apikey=None, seed=0, host='127.0.0.1', port=0):
+        # 紀錄由新到舊排列；位置 i 的紀錄預設屬於用戶 i+1 (users 較少時會重複)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.apikey = apikey
+        self.users = users or records
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts = Counter()
+        self.records = []
+        for i in range(records):
+            tags = [SHAPE_TAGS[i % len(SHAPE_TAGS)]] + ([ATTR_TAGS[i % len(ATTR_TAGS)]] if i % 3 else [])
+            self.records.append({
+                'tid': f'T{records - i:07d}',
+                'user_id': i % self.users + 1,
+                'tag_list': tags,
+                'created_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(time.time() - i * 600)),
+            })
+        self._by_tid = {r['tid']: r for r in self.records}
+        self._httpd = ThreadingHTTPServer((host, port), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}{API_PREFIX}'
+
+    def username_at(self, position):
+        return username_for(self.records[position]['user_id'])
+
+    def add_record(self, user_id):
+        # 模擬新掃描：插在最前面
+        with self._lock:
+            tid = f'T{len(self.records) + 1:07d}'
+            record = {'tid': tid, 'user_id': user_id, 'tag_list': [],
+                      'created_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime())}
+            self.records.insert(0, record)
+            self._by_tid[tid] = record
+            return record
+
+    def reset_counts(self):
+        with self._lock:
+            self.counts.clear()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='mock-tg3d', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _roll(self):
+        with self._lock:
+            return self._random.random()
+
+    def measurement(self, tid, pose):
+        # 由 tid 推出固定的量測值，方便重複驗證
+        n = int(tid[1:])
+        if pose == 'I':
+            return {'Chest Circumference': {'value': 75 + n % 40}, 'F Under Bust Circumference B': {'value': 63 + n % 30}}
+        return {'NSP to Apex Length (Left)': {'value': 20 + n % 5}, 'NSP to Apex Length (Right)': {'value': 20 + n % 4},
+                'Neck Shoulder Points Width': {'value': 11.5}, 'Narrow Waist Circumference': {'value': 68 + n % 20},
+                'Low Hip Circumference': {'value': 90 + n % 15}}
+
+    def _route(self, path, query):
+        parts = path[len(API_PREFIX):].strip('/').split('/')
+        if parts == ['scan_records']:
+            limit = int(query.get('limit', ['100'])[0])
+            offset = int(query.get('offset', ['0'])[0])
+            with self._lock:
+                page = self.records[offset:offset + limit]
+            return 'scan_records', 200, {'records': page}
+        if len(parts) == 2 and parts[0] == 'users':
+            uid = int(parts[1]) if parts[1].isdigit() else 0
+            if not 1 <= uid <= self.users:
+                return 'users', 404, {'error': 'not found'}
+            return 'users', 200, {'user': {'username': username_for(uid), 'nick_name': f'顧客{uid}'}, 'real_name': f'測試{uid}'}
+        if len(parts) >= 2 and parts[0] == 'scan_records' and parts[1] in self._by_tid:
+            tid = parts[1]
+            if len(parts) == 3 and parts[2] == 'size_xt':
+                return 'size_xt', 200, {'measurement': self.measurement(tid, query.get('pose', ['I'])[0])}
+            if len(parts) == 2:
+                return 'scan_record', 200, {'tid': tid, 'icon_url': ''}
+        return 'unknown', 404, {'error': 'not found'}
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                endpoint, status, body = server._route(url.path, query)
+                headers = {}
+                if server.apikey and query.get('apikey', [''])[0] != server.apikey:
+                    status, body = 401, {'error': 'invalid apikey'}
+                elif server.throttle_rate and server._roll() < server.throttle_rate:
+                    status, body = 429, {'error': 'too many requests'}
+                    if server.retry_after is not None: headers['Retry-After'] = str(server.retry_after)
+                elif server.error_rate and server._roll() < server.error_rate:
+                    status, body = 500, {'error': 'internal error'}
+                with server._lock:
+                    server.counts[endpoint] += 1
+                    server.counts['total'] += 1
+                delay = server.latency + (server._roll() * server.jitter if server.jitter else 0)
+                if delay: time.sleep(delay)
+
+                payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(payload)))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本機 TG3D API 替身")
+    parser.add_argument('--records', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=None)
+    parser.add_argument('--latency', type=float, default=0.05, help="每次呼叫的固定延遲 (秒)")
+    parser.add_argument('--jitter', type=float, default=0.0, help="額外的隨機延遲上限 (秒)")
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="回應 429 的比例")
+    parser.add_argument('--retry-after', type=int, default=None)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    server = MockTG3DServer(records=args.records, users=args.users, latency=args.latency, jitter=args.jitter,
+                            error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+                            retry_after=args.retry_after, port=args.port)
+    print(f"🧪 TG3D 替身伺服器啟動：{server.base_url} (共 {args.records} 筆紀錄)")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from aiohttp import web
+from catalog import ATTR_OPTIONS, UNKNOWN_ATTR
+from metrics import METRICS, stage
+from reference_data import load_reference, SIZE_TABLE_FILE
+from report import build_report
+from scan_index import ScanIndex
+from tg3d_client import TG3DClient, BASE_URL, get_tg3d_float
+from ttl_cache import TTLCache
+
+# --- 尺寸推薦 HTTP API (不需 Streamlit) ---
+# 與 app.py 共用 SizeEngine / RecommendationCatalog / ScanIndex / TG3DClient，供門市 POS 與官網呼叫。
+# 尺寸比對在事件迴圈內直接完成 (每次約數十微秒)；TG3D 的阻塞式呼叫交給執行緒池，不卡住其他請求。
+#
+#   TG3D_APIKEY=... python recommend_api.py --port 8080
+#
+#   POST /recommend        {"upper": 82, "lower": 65, "attr": "秀氣勻稱型", "left": 20, "right": 20}
+#   POST /recommend/batch  {"items": [{...}, {...}]}
+#   GET  /customer/{帳號關鍵字}   (量測數據尚未產生時回 409，measurements_pending=true)
+#   GET  /metrics          (Prometheus 文字格式)
+
+BATCH_LIMIT = 1000
+NEAREST_K = 3
+CUSTOMER_TTL = 60  # 顧客查詢結果快取秒數 (期間內新的掃描不會出現)
+
+dumps = partial(json.dumps, ensure_ascii=False)
+
+
+class BadRequest(ValueError):
+    pass
+
+
+class MeasurementsPending(Exception):
+    # 剛掃描完，TG3D 還沒算好 I-Pose / A-Pose 量測值
+    pass
+
+
+def parse_query(data):
+    # 驗證並正規化一筆推薦查詢；格式錯誤時拋出 BadRequest
+    if not isinstance(data, dict):
+        raise BadRequest("查詢必須是 JSON 物件")
+
+    def number(key, required=True):
+        value = data.get(key)
+        if value is None:
+            if required: raise BadRequest(f"缺少欄位 {key}")
+            return None
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            raise BadRequest(f"欄位 {key} 必須是數字")
+        if not math.isfinite(value): raise BadRequest(f"欄位 {key} 必須是數字")
+        return value
+
+    attr = data.get('attr') or UNKNOWN_ATTR
+    if attr not in ATTR_OPTIONS:
+        raise BadRequest(f"未知的胸型屬性：{attr}")
+    return {'upper': number('upper'), 'lower': number('lower'), 'attr': attr,
+            'left': number('left', required=False), 'right': number('right', required=False)}
+
+
+def plan_payload(plan):
+    return {
+        'number': plan.number, 'code': plan.code, 'label': plan.label, 'group': plan.group,
+        'products': [{'code': p, 'url': url} for p, url in zip(plan.products, plan.urls)],
+    }
+
+
+def recommend(engine, catalog, upper, lower, attr=UNKNOWN_ATTR, left=None, right=None):
+    # 與 app.py 共用 build_report：沒有任何區間命中時改列最接近的尺寸並附上差距 (cm)
+    report = build_report(engine, catalog, upper, lower, left, right, attr, nearest_k=NEAREST_K)
+    plans = [plan_payload(plan) for plan in report.plans]
+    if not report.matched:
+        plans = [dict(payload, distance=report.nearest[plan.number - 1].distance)
+                 for payload, plan in zip(plans, report.plans)]
+    return {'size_table': report.version, 'upper': upper, 'lower': lower, 'attr': attr,
+            'matched': report.matched, 'plans': plans}
+
+
+class RecommendService:
+    def __init__(self, engine, catalog, client=None, scan_index=None, workers=16, cache_size=50000):
+        self.engine = engine
+        self.catalog = catalog
+        self.client = client
+        self.scan_index = scan_index
+        self.cache = TTLCache(maxsize=cache_size)
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='recommend-api')
+        self._inflight = {}  # 同一個關鍵字同時有多個請求時只查一次 TG3D
+
+    def recommend_cached(self, query):
+        # 以完整精度當 key：尺寸區間邊界只差 0.01 cm，四捨五入會讓不同量測共用同一個答案
+        key = f"{query['upper']!r}|{query['lower']!r}|{query['attr']}|{query['left']!r}|{query['right']!r}"
+        return self.cache.get_or_load('recommend', key, lambda: recommend(self.engine, self.catalog, **query))
+
+    def load_customer(self, keyword):
+        # 在執行緒池中執行：同步索引 → 本地查詢 → 下載量測；查無此帳號回傳 None
+        with stage('api_customer'):
+            sync_error = None
+            try:
+                self.scan_index.sync(self.client, keyword=keyword)
+            except Exception as e:
+                sync_error = str(e)  # 同步失敗時改用本地索引
+            hit = self.scan_index.lookup(keyword)
+            if not hit: return None
+
+            record, user_data = hit
+            measurements = self.client.fetch_measurements(record['tid'])
+            failed = measurements.errors.get('pose_i') or measurements.errors.get('pose_a')
+            if failed: raise ConnectionError(f"下載測量數據失敗：{failed}")
+            m_i, m_a = measurements.pose_i, measurements.pose_a
+            if not m_i or not m_a:
+                # 不拿預設值 (82/65/20/20) 代替還沒算好的量測來推薦
+                raise MeasurementsPending(f"掃描紀錄 {record['tid']} 的量測數據尚未產生，請稍後再試")
+            tags = record.get('tag_list') or []
+            query = {
+                'upper': get_tg3d_float(m_i, 'Chest Circumference', 82.0),
+                'lower': get_tg3d_float(m_i, 'F Under Bust Circumference B', 65.0),
+                'attr': next((t for t in tags if t in ATTR_OPTIONS), UNKNOWN_ATTR),
+                'left': get_tg3d_float(m_a, 'NSP to Apex Length (Left)', 20.0),
+                'right': get_tg3d_float(m_a, 'NSP to Apex Length (Right)', 20.0),
+            }
+            return {
+                'tid': str(record['tid']),
+                'user_id': record.get('user_id'),
+                'nickname': user_data.get('user', {}).get('nick_name') or user_data.get('nickname') or '',
+                'tags': tags,
+                'icon_url': measurements.icon_url,
+                'measurements': query,
+                'recommendation': self.recommend_cached(query),
+                'sync_error': sync_error,
+            }
+
+    async def handle_recommend(self, request):
+        try:
+            query = parse_query(await request.json())
+        except ValueError as e:
+            return web.json_response({'error': str(e)}, status=400, dumps=dumps)
+        with stage('api_recommend'):
+            result = self.recommend_cached(query)
+        return web.json_response(result, dumps=dumps)
+
+    async def handle_batch(self, request):
+        try:
+            items = (await request.json()).get('items')
+        except (ValueError, AttributeError):
+            items = None
+        if not isinstance(items, list):
+            return web.json_response({'error': "請以 {\"items\": [...]} 傳入查詢清單"}, status=400, dumps=dumps)
+        if len(items) > BATCH_LIMIT:
+            return web.json_response({'error': f"一次最多 {BATCH_LIMIT} 筆"}, status=413, dumps=dumps)
+
+        results = []
+        with stage('api_recommend_batch', items=len(items)):
+            for item in items:
+                try:
+                    results.append(self.recommend_cached(parse_query(item)))
+                except BadRequest as e:
+                    results.append({'error': str(e)})
+        return web.json_response({'results': results}, dumps=dumps)
+
+    async def handle_customer(self, request):
+        keyword = request.match_info['keyword'].strip()
+        if not keyword:
+            return web.json_response({'error': "請輸入帳號關鍵字"}, status=400, dumps=dumps)
+        if self.client is None:
+            return web.json_response({'error': "未設定 TG3D_APIKEY"}, status=503, dumps=dumps)
+        hit, cached = self.cache.get('customer', keyword)
+        if hit: return web.json_response(cached, dumps=dumps)
+
+        future = self._inflight.get(keyword)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._inflight[keyword] = asyncio.ensure_future(loop.run_in_executor(self.pool, self.load_customer, keyword))
+            future.add_done_callback(lambda _: self._inflight.pop(keyword, None))
+        try:
+            result = await asyncio.shield(future)
+        except MeasurementsPending as e:
+            return web.json_response({'error': str(e), 'measurements_pending': True}, status=409, dumps=dumps)
+        except Exception as e:
+            return web.json_response({'error': str(e)}, status=502, dumps=dumps)
+        if result is None:
+            return web.json_response({'error': f"查無帳號「{keyword}」的掃描紀錄"}, status=404, dumps=dumps)
+        self.cache.set('customer', keyword, result, ttl=CUSTOMER_TTL)
+        return web.json_response(result, dumps=dumps)
+
+    async def handle_metrics(self, request):
+        return web.Response(text=METRICS.render_prometheus(), content_type='text/plain')
+
+    async def close(self, app=None):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        if self.client: self.client.close()
+
+    def app(self):
+        app = web.Application(client_max_size=8 * 1024 * 1024)
+        app.add_routes([
+            web.post('/recommend', self.handle_recommend),
+            web.post('/recommend/batch', self.handle_batch),
+            web.get('/customer/{keyword}', self.handle_customer),
+            web.get('/metrics', self.handle_metrics),
+        ])
+        app.on_cleanup.append(self.close)
+        return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="黛莉貝爾尺寸推薦 HTTP API")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--size-table', default=SIZE_TABLE_FILE, help="尺寸表檔名 (預設 %(default)s)")
+    parser.add_argument('--data-dir', default='.', help="參考資料表所在資料夾")
+    parser.add_argument('--workers', type=int, default=16, help="TG3D 查詢執行緒數")
+    parser.add_argument('--scan-index', default='tg3d_scan_index.sqlite3', help="與 app.py 共用的掃描索引")
+    parser.add_argument('--tg3d-cache', default='tg3d_cache.sqlite3', help="與 app.py 共用的 TG3D 回應快取")
+    args = parser.parse_args(argv)
+
+    engine, catalog = load_reference(args.size_table, base_dir=args.data_dir)
+    client = scan_index = None
+    apikey = os.environ.get('TG3D_APIKEY')
+    if apikey:
+        client = TG3DClient(apikey, base_url=os.environ.get('TG3D_BASE_URL', BASE_URL),
+                            max_workers=args.workers, cache=TTLCache(path=args.tg3d_cache))
+        scan_index = ScanIndex(args.scan_index)
+    else:
+        print("⚠️ 未設定環境變數 TG3D_APIKEY，/customer 將無法使用", file=sys.stderr)
+
+    service = RecommendService(engine, catalog, client, scan_index, workers=args.workers)
+    web.run_app(service.app(), host=args.host, port=args.port)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,191 @@
+import argparse
+import hashlib
+import os
+import pickle
+import sys
+from size_engine import SizeEngine
+from catalog import RecommendationCatalog
+
+# --- 參考資料表讀取 (不依賴 Streamlit，批次工具與 app.py 共用) ---
+# 四張 CSV 可預先編譯成一個快照檔 (含來源內容的 sha256)：啟動時只要雜湊相符就直接載入，
+# 不必逐一嘗試編碼、也不必匯入 pandas；CSV 有改動時自動退回讀取 CSV。
+#
+#   python reference_data.py            # 檢查尺寸表並寫出 reference_snapshot.pkl
+#   python reference_data.py --strict   # 有任何警告就不寫出快照
+
+SIZE_TABLE_FILE = "調整尺寸_2.58版.csv"
+PRODUCT_MAPPING_FILE = '商品對應尺寸表.csv'
+BREAST_ATTR_FILE = '胸型屬性.csv'
+URL_FILE = '款式官網連結.csv'
+
+ENCODINGS = ['utf-8-sig', 'utf-8', 'cp950', 'big5']
+
+SNAPSHOT_FILE = 'reference_snapshot.pkl'
+SNAPSHOT_FORMAT = 1
+GAP_TOLERANCE = 0.011  # 尺寸表相鄰區間以 0.01 cm 銜接，超過這個距離視為斷層
+
+
+class ReferenceDataError(Exception):
+    pass
+
+
+def read_reference_csv(file_name):
+    if not os.path.exists(file_name):
+        raise FileNotFoundError(file_name)
+
+    import pandas as pd  # 只有沒有可用快照時才需要
+
+    last_error = ""
+    for enc in ENCODINGS:
+        try:
+            df = pd.read_csv(file_name, encoding=enc)
+            if '對應尺寸群組' in df.columns:
+                df['對應尺寸群組'] = df['對應尺寸群組'].astype(str).str.replace('.', ',', regex=False)
+            return df
+        except Exception as e:
+            last_error = str(e)
+            continue
+    raise ReferenceDataError(last_error)
+
+
+def source_hash(size_file=SIZE_TABLE_FILE, base_dir='.'):
+    # 四張 CSV 的內容雜湊；缺少的選用檔也算在內，補上檔案後快照會自動失效
+    digest = hashlib.sha256()
+    for name in (size_file, PRODUCT_MAPPING_FILE, BREAST_ATTR_FILE, URL_FILE):
+        digest.update(name.encode('utf-8') + b'\0')
+        path = os.path.join(base_dir, name)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                digest.update(b'1' + f.read())
+        else:
+            digest.update(b'0')
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def load_reference_csv(size_file=SIZE_TABLE_FILE, base_dir='.'):
+    # 直接由 CSV 建立 (SizeEngine, RecommendationCatalog)；胸型屬性與官網連結表缺少時照樣可用
+    def optional(name):
+        try:
+            return read_reference_csv(os.path.join(base_dir, name))
+        except (FileNotFoundError, ReferenceDataError):
+            return None
+
+    size_table = read_reference_csv(os.path.join(base_dir, size_file))
+    product_mapping = read_reference_csv(os.path.join(base_dir, PRODUCT_MAPPING_FILE))
+    engine = SizeEngine.from_frame(size_table, version=size_file)
+    catalog = RecommendationCatalog.from_frames(product_mapping, optional(BREAST_ATTR_FILE), optional(URL_FILE))
+    return engine, catalog
+
+
+def validate_reference(engine, catalog):
+    # 回傳 (錯誤, 警告) 兩個訊息清單。錯誤：缺值、上下限顛倒、商品表沒有的尺寸群組；
+    # 警告：同一群組與下胸圍區間內上胸圍重疊或斷層、同一群組的下胸圍區間重疊或斷層、沒有官網連結的款式
+    errors, warnings = [], []
+    cells = {}
+    for i, code in enumerate(engine.codes.tolist()):
+        up_lo, up_hi = engine.upper_lo[i], engine.upper_hi[i]
+        low_lo, low_hi = engine.lower_lo[i], engine.lower_hi[i]
+        if any(v != v for v in (up_lo, up_hi, low_lo, low_hi)):
+            errors.append(f"{code}：胸圍區間缺值")
+            continue
+        if up_lo > up_hi or low_lo > low_hi:
+            errors.append(f"{code}：區間下限大於上限")
+            continue
+        cells.setdefault((engine.groups[i], low_lo, low_hi), []).append(i)
+
+    def check(kind, where, intervals):
+        # intervals: [(名稱, 下限, 上限)]，依下限排序後檢查相鄰兩段
+        intervals = sorted(intervals, key=lambda x: (x[1], x[2]))
+        for (name_a, _, hi_a), (name_b, lo_b, _) in zip(intervals, intervals[1:]):
+            if lo_b <= hi_a:
+                warnings.append(f"{where}：{kind} {name_a} 與 {name_b} 重疊")
+            elif lo_b - hi_a > GAP_TOLERANCE:
+                warnings.append(f"{where}：{kind} {name_a} 與 {name_b} 之間有 {lo_b - hi_a:.2f} cm 斷層")
+
+    bands = {}
+    for (group, low_lo, low_hi), ids in sorted(cells.items()):
+        where = f"群組「{group}」下胸圍 {low_lo:g}-{low_hi:g}"
+        check('上胸圍', where, [(engine.codes[i], engine.upper_lo[i], engine.upper_hi[i]) for i in ids])
+        bands.setdefault(group, []).append((f"{low_lo:g}-{low_hi:g}", low_lo, low_hi))
+    for group, intervals in bands.items():
+        check('下胸圍區間', f"群組「{group}」", intervals)
+
+    for group in sorted(set(engine.groups.tolist()) - set(catalog.group_products)):
+        errors.append(f"尺寸群組「{group}」不在{PRODUCT_MAPPING_FILE}中")
+    missing_urls = sorted({p for products in catalog.group_products.values() for p in products if not catalog.urls.get(p)})
+    for product in missing_urls:
+        warnings.append(f"款式 {product} 沒有官網連結")
+    return errors, warnings
+
+
+def compile_snapshot(size_file=SIZE_TABLE_FILE, base_dir='.', path=SNAPSHOT_FILE, strict=False):
+    # 讀 CSV、檢查後寫出快照；回傳 (錯誤, 警告)。有錯誤 (strict 時含警告) 就不寫檔
+    digest = source_hash(size_file, base_dir)
+    engine, catalog = load_reference_csv(size_file, base_dir)
+    errors, warnings = validate_reference(engine, catalog)
+    if errors or (strict and warnings): return errors, warnings
+
+    snapshot = {
+        'format': SNAPSHOT_FORMAT,
+        'source_hash': digest,
+        'size_file': size_file,
+        'engine': {
+            'codes': engine.codes.tolist(), 'labels': engine.labels.tolist(), 'groups': engine.groups.tolist(),
+            'upper_lo': engine.upper_lo.tolist(), 'upper_hi': engine.upper_hi.tolist(),
+            'lower_lo': engine.lower_lo.tolist(), 'lower_hi': engine.lower_hi.tolist(),
+        },
+        'catalog': {
+            'group_products': catalog.group_products,
+            'attr_products': {a: sorted(ps) for a, ps in catalog.attr_products.items()},
+            'urls': catalog.urls,
+        },
+    }
+    target = os.path.join(base_dir, path)
+    tmp = f"{target}.tmp"
+    with open(tmp, 'wb') as f:
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, target)
+    return errors, warnings
+
+
+def load_snapshot(size_file=SIZE_TABLE_FILE, base_dir='.', path=SNAPSHOT_FILE):
+    # 快照不存在、格式不符、或 CSV 內容已改變時回傳 None
+    try:
+        with open(os.path.join(base_dir, path), 'rb') as f:
+            snapshot = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+    if (snapshot.get('format') != SNAPSHOT_FORMAT or snapshot.get('size_file') != size_file
+            or snapshot.get('source_hash') != source_hash(size_file, base_dir)):
+        return None
+    engine = SizeEngine(version=size_file, **snapshot['engine'])
+    catalog = RecommendationCatalog(**snapshot['catalog'])
+    return engine, catalog
+
+
+def load_reference(size_file=SIZE_TABLE_FILE, base_dir='.'):
+    # 回傳 (SizeEngine, RecommendationCatalog)；有相符的快照就用快照，否則讀 CSV
+    return load_snapshot(size_file, base_dir) or load_reference_csv(size_file, base_dir)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="檢查參考資料表並編譯成快照")
+    parser.add_argument('--size-table', default=SIZE_TABLE_FILE)
+    parser.add_argument('--data-dir', default='.')
+    parser.add_argument('--output', default=SNAPSHOT_FILE, help="快照檔名 (相對於 --data-dir)")
+    parser.add_argument('--strict', action='store_true', help="有任何警告也不寫出快照")
+    args = parser.parse_args(argv)
+
+    errors, warnings = compile_snapshot(args.size_table, args.data_dir, args.output, strict=args.strict)
+    for message in errors: print(f"❌ {message}")
+    for message in warnings: print(f"⚠️ {message}")
+    if errors or (args.strict and warnings):
+        print("快照未更新")
+        return 1
+    print(f"✅ 已寫出 {os.path.join(args.data_dir, args.output)} (錯誤 0 / 警告 {len(warnings)})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
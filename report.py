@@ -0,0 +1,42 @@
+from dataclasses import dataclass
+
+# --- 建議報告 ---
+# 報告只由量測值、胸型屬性與尺寸表版本決定：方案、Email 內文與 Google Sheets 紀錄字串一次算好，
+# app.py 以 st.cache_data 快取，介面重跑時直接沿用。顧客姓名只影響 Email 開頭的稱呼，不在報告裡。
+
+EMAIL_TITLE = "【黛莉貝爾建議報表】\n"
+
+
+@dataclass(frozen=True)
+class Report:
+    upper: float
+    lower: float
+    lsn: float
+    rsn: float
+    attr: str
+    version: str
+    matched: bool         # 是否有尺寸區間命中
+    plans: tuple          # catalog.Plan；沒有命中時為最接近尺寸的方案
+    nearest: tuple = ()   # 沒有命中時的 size_engine.NearestSize (依 plan.number - 1 對應)
+    email_text: str = ''  # Email 內文 (不含開頭稱呼)
+    log_text: str = ''    # 寫入 Google Sheets 的推薦摘要
+
+    def email_body(self, user_name=''):
+        body = EMAIL_TITLE
+        if user_name: body += f"親愛的 {user_name} 您好：\n\n"
+        return body + self.email_text
+
+
+def build_report(engine, catalog, upper, lower, lsn, rsn, attr, nearest_k=3):
+    # engine: SizeEngine；catalog: RecommendationCatalog
+    fields = dict(upper=upper, lower=lower, lsn=lsn, rsn=rsn, attr=attr, version=engine.version)
+    matches = engine.lookup(upper, lower)
+    if not matches:
+        nearest = tuple(engine.nearest(upper, lower, k=nearest_k, left=lsn, right=rsn))
+        return Report(matched=False, plans=tuple(catalog.plans(nearest, attr)), nearest=nearest, **fields)
+
+    plans = tuple(catalog.plans(matches, attr))
+    email_text = f"測量數據：\n  - 上胸圍 {upper} cm / 下胸圍 {lower} cm\n  - 頸肩-乳尖(左) {lsn} cm / 頸肩-乳尖(右) {rsn} cm\n判定屬性：{attr}\n\n"
+    email_text += ''.join(f"方案 {plan.number}：{plan.label} (群組 {plan.group})\n建議款式：{', '.join(plan.products)}\n\n" for plan in plans)
+    log_text = ''.join(f"[方案{plan.number}: 尺寸{plan.label}, 款式:{'/'.join(plan.products)}] " for plan in plans)
+    return Report(matched=True, plans=plans, email_text=email_text, log_text=log_text, **fields)
@@ -0,0 +1,272 @@
+import json
+import sqlite3
+import threading
+from metrics import stage
+from tg3d_client import TG3DError
+
+# --- TG3D 掃描紀錄本地索引 ---
+# 以 SQLite 保存「帳號 → user_id → 最新 tid」的對應，
+# 每次查詢前只需從 offset 0 往後同步到「已知紀錄」為止 (增量同步)，
+# 查詢本身就是一次本地 SQL，不再受限於「近期 500 筆」。
+# 帶關鍵字同步時命中即停止；未同步的區段以 gaps 表記錄 (存放提前結束時最舊的那筆 tid)。
+
+PAGE_SIZE = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scans (
+    tid TEXT PRIMARY KEY,
+    user_id TEXT,
+    seq REAL NOT NULL,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_scans_user ON scans (user_id, seq);
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    username TEXT NOT NULL DEFAULT '',
+    nickname TEXT NOT NULL DEFAULT '',
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_users_username ON users (username);
+CREATE TABLE IF NOT EXISTS gaps (
+    tid TEXT PRIMARY KEY
+);
+"""
+
+
+class ScanIndex:
+    def __init__(self, path):
+        self.path = path
+        # 同一個程序內同時只允許一個同步，第二位店員會等第一位同步完再做極小的增量
+        self._sync_lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _known_tids(self, conn, tids):
+        if not tids: return set()
+        marks = ",".join("?" * len(tids))
+        rows = conn.execute(f"SELECT tid FROM scans WHERE tid IN ({marks})", tids).fetchall()
+        return {r[0] for r in rows}
+
+    def _missing_user_ids(self, conn):
+        rows = conn.execute(
+            "SELECT DISTINCT s.user_id FROM scans s LEFT JOIN users u ON u.user_id = s.user_id "
+            "WHERE s.user_id IS NOT NULL AND u.user_id IS NULL"
+        ).fetchall()
+        return [r[0] for r in rows]
+
+    def count(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM scans").fetchone()[0]
+
+    def sync(self, client, keyword=None, progress=None, max_pages=None):
+        # client: TG3DClient；progress(已比對筆數, 新增筆數) 供進度條使用
+        # keyword: 有指定時邊收用戶資料邊比對，依紀錄順序命中第一筆 (最新) 就停止並取消其餘請求；
+        # max_pages: 最多只翻幾頁 (背景輪詢用，避免空索引時整段補齊而長時間占住同步鎖)；
+        # 沒同步完的部分記成 gap，下一次同步會自動補齊
+        def fetch_user(uid):
+            try:
+                return client.get_user(uid)
+            except TG3DError:
+                return None  # 下次同步會重新補抓
+
+        def fetch_page(offset):
+            with stage('tg3d_search_page'):
+                return [r for r in client.list_scan_records(limit=PAGE_SIZE, offset=offset) if r.get('tid') is not None]
+
+        with self._sync_lock:
+            conn = self._connect()
+            executor = client.executor
+            user_futures = {}
+            next_page = None
+            try:
+                pending_gaps = {r[0] for r in conn.execute("SELECT tid FROM gaps").fetchall()}
+                passed_gaps = []    # 已經過、但後面還沒接上新紀錄的 gap
+                resolved_gaps = []  # 後面已接上新紀錄的 gap，可以刪除
+                stored = {r[0] for r in conn.execute("SELECT user_id FROM users").fetchall()}
+                # 之前提前結束而沒抓到的用戶：比對走到時才依紀錄順序補抓，其餘等同步完整跑完時再一次補齊，
+                # 不會每次搜尋都先排在目標前面
+                missing = self._missing_user_ids(conn)
+                missing_set = set(missing)
+
+                def fetch_ahead(cursor):
+                    # 連同後面幾筆一起送出 (與執行緒池同寬)，比對時不必一筆一筆等
+                    if walk[cursor] not in missing_set or walk[cursor] in user_futures: return
+                    for uid in walk[cursor:cursor + client.max_workers]:
+                        if uid in missing_set and uid not in user_futures:
+                            user_futures[uid] = executor.submit(fetch_user, uid)
+
+                # 1. 由最新往舊翻頁，碰到已知 tid (且沒有待補的 gap) 就停止
+                new_records = []  # (紀錄, 它前面最近一筆已知紀錄的 tid；None 代表在最前面)
+                walk = []         # 依紀錄順序的 user_id (含有待補 gap 時跳過的已知紀錄)，供關鍵字比對
+                anchor = None
+                last_is_new = False
+                cursor = 0
+                complete = False
+                page_limited = False  # 因 max_pages 停止 (不是命中而提前結束)
+                offset = 0
+                next_page = executor.submit(fetch_page, 0)
+                while True:
+                    records = next_page.result()
+                    next_page = None
+                    if not records:
+                        complete = True
+                        break
+                    known = self._known_tids(conn, [str(r['tid']) for r in records])
+                    reached_known = False
+                    page_uids = []
+                    for record in records:
+                        tid = str(record['tid'])
+                        if tid in known:
+                            if tid in pending_gaps:
+                                pending_gaps.discard(tid)
+                                passed_gaps.append(tid)
+                            elif not pending_gaps:
+                                reached_known = True
+                                break
+                            anchor = tid
+                            last_is_new = False
+                            walk.append(str(record['user_id']) if record.get('user_id') else None)
+                            continue
+                        new_records.append((record, anchor))
+                        resolved_gaps += passed_gaps
+                        passed_gaps = []
+                        last_is_new = True
+                        uid = str(record['user_id']) if record.get('user_id') else None
+                        walk.append(uid)
+                        if uid and uid not in stored and uid not in user_futures:
+                            user_futures[uid] = executor.submit(fetch_user, uid)
+                            page_uids.append(uid)
+                    if progress: progress(offset + len(records), len(new_records))
+
+                    more = not reached_known and len(records) == PAGE_SIZE
+                    limited = more and max_pages is not None and offset // PAGE_SIZE + 1 >= max_pages
+                    # ⭐ 預先抓下一頁，和這一頁的用戶查詢同時進行
+                    if more and not limited: next_page = executor.submit(fetch_page, offset + PAGE_SIZE)
+
+                    if keyword:
+                        with stage('tg3d_user_batch', items=len(page_uids)):
+                            matched, cursor = self._first_match(conn, walk, cursor, user_futures, str(keyword), fetch_ahead)
+                        if matched:
+                            complete = not more
+                            break
+                    if limited:
+                        page_limited = True
+                        break
+                    if not more:
+                        complete = True
+                        break
+                    offset += PAGE_SIZE
+
+                # 2. 命中而提前結束時取消還沒開始的請求；已在執行中的不等待 (下次同步會補抓)
+                #    完整同步補齊所有缺少的用戶；因 max_pages 停止時只補走過的那幾頁，並等它們回來
+                if next_page is not None: next_page.cancel()
+                users = {}
+                if complete or page_limited:
+                    for uid in (missing if complete else walk):
+                        if uid in missing_set and uid not in user_futures:
+                            user_futures[uid] = executor.submit(fetch_user, uid)
+                    with stage('tg3d_user_batch', items=len(user_futures)) as span:
+                        for uid, future in user_futures.items():
+                            data = future.result()
+                            if data: users[uid] = data
+                        if len(users) < len(user_futures): span.fail('TG3DError')
+                else:
+                    for uid, future in user_futures.items():
+                        if future.cancel() or not future.done(): continue
+                        data = future.result()
+                        if data: users[uid] = data
+
+                # 3. 一次交易寫入
+                with conn:
+                    conn.executemany(
+                        "INSERT OR IGNORE INTO scans (tid, user_id, seq, record) VALUES (?, ?, ?, ?)",
+                        [
+                            (str(r['tid']), str(r['user_id']) if r.get('user_id') else None, seq, json.dumps(r, ensure_ascii=False))
+                            for r, seq in self._assign_seq(conn, new_records)
+                        ],
+                    )
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO users (user_id, username, nickname, data) VALUES (?, ?, ?, ?)",
+                        [
+                            (uid, str(data.get('user', {}).get('username') or ''),
+                             str(data.get('user', {}).get('nick_name') or data.get('nickname') or ''),
+                             json.dumps(data, ensure_ascii=False))
+                            for uid, data in users.items()
+                        ],
+                    )
+                    if complete:
+                        conn.execute("DELETE FROM gaps")
+                    else:
+                        conn.executemany("DELETE FROM gaps WHERE tid = ?", [(tid,) for tid in resolved_gaps])
+                        if last_is_new:
+                            conn.execute("INSERT OR IGNORE INTO gaps (tid) VALUES (?)", (str(new_records[-1][0]['tid']),))
+                return len(new_records)
+            finally:
+                if next_page is not None: next_page.cancel()
+                for future in user_futures.values():
+                    future.cancel()
+                conn.close()
+
+    def _first_match(self, conn, walk, cursor, user_futures, keyword, fetch_ahead=None):
+        # 依紀錄順序往下比對；遇到還沒回來的用戶就等它 (其他請求照樣在背景進行)
+        # fetch_ahead(cursor): 需要時才送出缺少的用戶查詢。回傳 (是否命中, 下次從哪一筆繼續)
+        while cursor < len(walk):
+            if fetch_ahead: fetch_ahead(cursor)
+            uid = walk[cursor]
+            username = ''
+            if uid in user_futures:
+                data = user_futures[uid].result()
+                username = str((data or {}).get('user', {}).get('username') or '')
+            elif uid:
+                row = conn.execute("SELECT username FROM users WHERE user_id = ?", (uid,)).fetchone()
+                username = row[0] if row else ''
+            cursor += 1
+            if username and keyword in username:
+                return True, cursor
+        return False, cursor
+
+    def _assign_seq(self, conn, new_records):
+        # 越新的紀錄 seq 越大。每一段連續的新紀錄夾在「前一筆已知紀錄」與資料庫中比它舊的下一筆之間，
+        # 補齊 gap 時也能維持正確的新舊順序
+        result = []
+        i = 0
+        while i < len(new_records):
+            anchor = new_records[i][1]
+            j = i
+            while j < len(new_records) and new_records[j][1] == anchor:
+                j += 1
+            run = [r for r, _ in new_records[i:j]]
+            if anchor is None:
+                lo = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM scans").fetchone()[0]
+                hi = lo + len(run) + 1
+            else:
+                hi = conn.execute("SELECT seq FROM scans WHERE tid = ?", (anchor,)).fetchone()[0]
+                lo = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM scans WHERE seq < ?", (hi,)).fetchone()[0]
+            step = (hi - lo) / (len(run) + 1)
+            result.extend((r, hi - step * (k + 1)) for k, r in enumerate(run))
+            i = j
+        return result
+
+    def recent(self, limit=10):
+        # 最新的幾筆掃描：[(紀錄, 用戶資料或 None)]，由新到舊
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT s.record, u.data FROM scans s LEFT JOIN users u ON u.user_id = s.user_id "
+                "ORDER BY s.seq DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [(json.loads(record), json.loads(data) if data else None) for record, data in rows]
+
+    def lookup(self, keyword):
+        # 與原本的比對規則相同：帳號「包含」關鍵字即命中，取最新一筆掃描
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT s.record, u.data FROM scans s JOIN users u ON u.user_id = s.user_id "
+                "WHERE u.username != '' AND instr(u.username, ?) > 0 ORDER BY s.seq DESC LIMIT 1",
+                (str(keyword),),
+            ).fetchone()
+        if row is None: return None
+        return json.loads(row[0]), json.loads(row[1])
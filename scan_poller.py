@@ -0,0 +1,76 @@
+import logging
+import threading
+import time
+from metrics import stage
+
+logger = logging.getLogger(__name__)
+
+# --- 新掃描背景輪詢 ---
+# 顧客掃描完走到櫃台之前，就先把新紀錄同步進 ScanIndex，並預先下載用戶資料與 I/A-Pose 量測值
+# (存進 TG3DClient 的回應快取)。店員搜尋或從「最近掃描」點選時，資料幾乎都已在本地。
+# 每輪只同步最前面幾頁：空索引 (或索引檔遺失) 時不在背景補齊整段歷史，
+# 以免長時間占住 ScanIndex 的同步鎖與共用執行緒池；較舊的紀錄交給店員搜尋時的增量同步補上。
+
+
+class ScanPoller:
+    def __init__(self, client, scan_index, interval=5.0, prefetch=20, max_backoff=300.0, max_pages=1):
+        # client: TG3DClient (需設定 cache 才有預先下載的效果)；scan_index: ScanIndex
+        # prefetch: 只替最新的幾筆掃描預先下載量測值 (剛掃描完可能還沒算好，之後每輪重試)
+        self.client = client
+        self.scan_index = scan_index
+        self.interval = interval
+        self.prefetch = prefetch
+        self.max_pages = max_pages
+        self.max_backoff = max_backoff
+        self.last_poll = 0.0
+        self.last_error = ""
+        self._warm = set()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='scan-poller', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def fresh(self):
+        # 最近一輪輪詢是否在兩個間隔內成功 (可以直接相信本地索引)
+        return time.monotonic() - self.last_poll < 2 * self.interval
+
+    def is_warm(self, tid):
+        return str(tid) in self._warm
+
+    def recent(self, limit=10):
+        return self.scan_index.recent(limit)
+
+    def poll_once(self):
+        # 同步索引 (通常只有第一頁) 後，替還沒預先下載的新紀錄抓量測值；回傳新增的掃描筆數
+        with stage('scan_poll'):
+            added = self.scan_index.sync(self.client, max_pages=self.max_pages)
+        tids = [str(record['tid']) for record, _ in self.scan_index.recent(self.prefetch)]
+        pending = [tid for tid in tids if tid not in self._warm]
+        if pending:
+            with stage('scan_prefetch', items=len(pending)):
+                for tid in pending:
+                    measurements = self.client.fetch_measurements(tid)
+                    if measurements.pose_i and measurements.pose_a and not measurements.errors:
+                        self._warm.add(tid)
+        self._warm.intersection_update(tids)
+        self.last_poll = time.monotonic()
+        return added
+
+    def _run(self):
+        backoff = 0.0
+        while not self._stop.is_set():
+            try:
+                self.poll_once()
+                backoff = 0.0
+                self.last_error = ""
+            except Exception as e:
+                # TG3D 暫時無法連線：拉長間隔，恢復後回到原本的輪詢頻率
+                self.last_error = str(e)
+                backoff = min(self.max_backoff, max(self.interval, backoff * 2))
+                logger.warning("輪詢 TG3D 掃描紀錄失敗，%.1f 秒後重試: %s", backoff, e)
+            self._stop.wait(backoff or self.interval)
@@ -0,0 +1,124 @@
+import bisect
+from collections import namedtuple
+import numpy as np
+
+# --- 尺寸查詢引擎 ---
+# 每個尺寸表版本只建一次：先依「下胸圍區間」分組，組內依上胸圍下限排序，
+# 查詢時用二分搜尋找出候選區間，不再每次對整張表做四欄布林遮罩。
+# 沒有任何區間命中時，nearest() 一次算出與每個尺寸框的距離，回傳最接近的 k 個尺寸。
+
+SizeMatch = namedtuple('SizeMatch', ['row', 'code', 'label', 'group'])
+SizeMatches = namedtuple('SizeMatches', ['query', 'row', 'code', 'label', 'group'])
+# distance: 與尺寸框 (上胸圍區間 × 下胸圍區間) 的距離 (cm)
+NearestSize = namedtuple('NearestSize', ['row', 'code', 'label', 'group', 'distance'])
+
+COL_CODE = '尺寸代號'
+COL_UPPER_LO, COL_UPPER_HI = '上胸圍1', '上胸圍2'
+COL_LOWER_LO, COL_LOWER_HI = '下胸圍1', '下胸圍2'
+COL_LABEL = '對應尺寸請使用.號隔開'
+COL_GROUP = '對應尺寸群組'
+
+TIE_CM = 0.01        # 距離差在這個範圍內視為同樣接近
+ASYMMETRY_CM = 1.0   # 左右頸肩-乳尖長相差超過這個值視為左右不對稱
+
+
+class SizeEngine:
+    def __init__(self, codes, upper_lo, upper_hi, lower_lo, lower_hi, labels, groups, version=''):
+        self.version = version
+        self.codes = np.asarray(codes, dtype=object)
+        self.labels = np.asarray(labels, dtype=object)
+        self.groups = np.asarray(groups, dtype=object)
+        self.upper_lo = np.asarray(upper_lo, dtype=float)
+        self.upper_hi = np.asarray(upper_hi, dtype=float)
+        self.lower_lo = np.asarray(lower_lo, dtype=float)
+        self.lower_hi = np.asarray(lower_hi, dtype=float)
+
+        # 任一邊界缺值的列永遠不會命中 (與原本的 pandas 比較結果相同)，建索引時直接略過
+        valid = ~(np.isnan(self.upper_lo) | np.isnan(self.upper_hi) | np.isnan(self.lower_lo) | np.isnan(self.lower_hi))
+        self._valid_ids = np.flatnonzero(valid)
+        self._upper_center = (self.upper_lo + self.upper_hi) / 2
+        bands = sorted({(lo, hi) for lo, hi in zip(self.lower_lo[valid], self.lower_hi[valid])})
+        self.band_lo = np.array([b[0] for b in bands], dtype=float)
+        self.band_hi = np.array([b[1] for b in bands], dtype=float)
+
+        # 每個下胸圍區間：(上胸圍下限[已排序], 上胸圍上限, 原始列號, 最大區間寬度)
+        self._bands = []
+        for lo, hi in bands:
+            ids = np.flatnonzero(valid & (self.lower_lo == lo) & (self.lower_hi == hi))
+            ids = ids[np.argsort(self.upper_lo[ids], kind='stable')]
+            width = float((self.upper_hi[ids] - self.upper_lo[ids]).max())
+            self._bands.append((self.upper_lo[ids], self.upper_hi[ids], ids, width))
+        # 單筆查詢走純 Python 的 bisect，省去 NumPy 呼叫的固定成本
+        self._rows = list(zip(self.codes.tolist(), self.labels.tolist(), self.groups.tolist()))
+        self._scalar_bands = [
+            (float(lo), float(hi), up_lo.tolist(), up_hi.tolist(), ids.tolist(), width)
+            for (lo, hi), (up_lo, up_hi, ids, width) in zip(bands, self._bands)
+        ]
+
+    @classmethod
+    def from_frame(cls, df, version=''):
+        return cls(
+            df[COL_CODE].tolist(), df[COL_UPPER_LO].tolist(), df[COL_UPPER_HI].tolist(),
+            df[COL_LOWER_LO].tolist(), df[COL_LOWER_HI].tolist(), df[COL_LABEL].tolist(),
+            df[COL_GROUP].astype(str).tolist(), version=version,
+        )
+
+    def __len__(self):
+        return len(self.codes)
+
+    def match(self, row):
+        return SizeMatch(int(row), *self._rows[row])
+
+    def lookup(self, upper, lower):
+        # 回傳所有「上下胸圍都落在區間內」的尺寸，順序與尺寸表相同
+        upper, lower = float(upper), float(lower)
+        rows = []
+        for lo, hi, up_lo, up_hi, ids, width in self._scalar_bands:
+            if not (lo <= lower <= hi): continue
+            start = bisect.bisect_left(up_lo, upper - width)
+            end = bisect.bisect_right(up_lo, upper)
+            rows.extend(ids[k] for k in range(start, end) if up_hi[k] >= upper)
+        rows.sort()
+        return [self.match(r) for r in rows]
+
+    def lookup_many(self, upper, lower):
+        # 向量化批次查詢；query 為輸入陣列中的位置，一位顧客可能命中多個尺寸
+        upper = np.asarray(upper, dtype=float)
+        lower = np.asarray(lower, dtype=float)
+        query_parts, row_parts = [], []
+        for b, (up_lo, up_hi, ids, width) in enumerate(self._bands):
+            in_band = np.flatnonzero((self.band_lo[b] <= lower) & (lower <= self.band_hi[b]))
+            if not in_band.size: continue
+            u = upper[in_band]
+            start = np.searchsorted(up_lo, u - width, side='left')
+            end = np.searchsorted(up_lo, u, side='right')
+            last = len(up_lo) - 1
+            # 候選窗口很小 (同一點最多重疊幾個群組)，逐一位移檢查上限即可
+            for j in range(int((end - start).max())):
+                k = start + j
+                k_safe = np.minimum(k, last)
+                ok = (k < end) & (up_hi[k_safe] >= u)
+                query_parts.append(in_band[ok])
+                row_parts.append(ids[k_safe[ok]])
+        if query_parts:
+            query = np.concatenate(query_parts)
+            row = np.concatenate(row_parts)
+        else:
+            query = np.empty(0, dtype=np.intp)
+            row = np.empty(0, dtype=np.intp)
+        order = np.lexsort((row, query))
+        query, row = query[order], row[order]
+        return SizeMatches(query, row, self.codes[row], self.labels[row], self.groups[row])
+
+    def nearest(self, upper, lower, k=3, left=None, right=None):
+        # 依與尺寸框的歐氏距離排序 (落在框內為 0)，回傳前 k 個 NearestSize；
+        # 距離相同時，若左右頸肩-乳尖長 (left/right) 明顯不對稱，優先較大的上胸圍 (容納較豐滿的一側)，否則依尺寸表順序
+        upper, lower = float(upper), float(lower)
+        ids = self._valid_ids
+        du = np.maximum(np.maximum(self.upper_lo[ids] - upper, upper - self.upper_hi[ids]), 0.0)
+        dl = np.maximum(np.maximum(self.lower_lo[ids] - lower, lower - self.lower_hi[ids]), 0.0)
+        distance = np.hypot(du, dl)
+        asymmetric = left is not None and right is not None and abs(float(left) - float(right)) >= ASYMMETRY_CM
+        prefer = -self._upper_center[ids] if asymmetric else np.zeros(len(ids))
+        order = np.lexsort((ids, prefer, np.round(distance / TIE_CM)))[:k]
+        return [NearestSize(int(ids[i]), *self._rows[ids[i]], round(float(distance[i]), 2)) for i in order]
@@ -0,0 +1,104 @@
+import socket
+import time
+import pytest
+from email_outbox import EmailOutbox
+
+aiosmtpd_controller = pytest.importorskip('aiosmtpd.controller')
+
+# --- 寄件匣對本機 SMTP 替身 (aiosmtpd) 的整合測試 ---
+# 收件者 refused@ 會被拒收；drop@ 第一次寄送時伺服器直接斷線，模擬 Gmail 中途斷開連線。
+
+
+class RecordingHandler:
+    def __init__(self):
+        self.peers = set()      # 每條連線的用戶端位址 (用來計算開了幾條連線)
+        self.delivered = []
+        self.dropped = 0
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith('refused@'):
+            return '550 5.1.1 User unknown'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        self.peers.add(session.peer)
+        if envelope.rcpt_tos == ['drop@example.com'] and not self.dropped:
+            self.dropped += 1
+            server.transport.close()
+            return '421 connection dropped'
+        self.delivered.extend(envelope.rcpt_tos)
+        return '250 Message accepted'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(predicate, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate(): return True
+        time.sleep(0.05)
+    return False
+
+
+@pytest.fixture
+def smtp():
+    handler = RecordingHandler()
+    controller = aiosmtpd_controller.Controller(handler, hostname='127.0.0.1', port=free_port())
+    controller.start()
+    yield handler, controller.port
+    controller.stop()
+
+
+@pytest.fixture
+def outbox(smtp, tmp_path):
+    _, port = smtp
+    return EmailOutbox('shop@example.com', '', str(tmp_path / 'outbox.sqlite3'), host='127.0.0.1', port=port,
+                       starttls=False, poll_interval=0.05, backoff=0.05)
+
+
+def test_batch_reuses_one_connection(smtp, outbox):
+    handler, _ = smtp
+    ids = [outbox.enqueue(f'customer{i}@example.com', '建議報表', f'第 {i} 封') for i in range(5)]
+    assert wait_for(lambda: all(outbox.status(i)['status'] == 'sent' for i in ids))
+    assert sorted(handler.delivered) == sorted(f'customer{i}@example.com' for i in range(5))
+    assert len(handler.peers) == 1
+
+
+def test_refused_recipient_is_failed_without_retry(smtp, outbox):
+    handler, _ = smtp
+    refused = outbox.enqueue('refused@example.com', '建議報表', '內文')
+    ok = outbox.enqueue('customer@example.com', '建議報表', '內文')
+    assert wait_for(lambda: outbox.status(ok)['status'] == 'sent')
+    status = outbox.status(refused)
+    assert status['status'] == 'failed'
+    assert status['attempts'] == 1
+    assert 'User unknown' in status['last_error']
+    # 拒收不會關閉連線，後面的信沿用同一條
+    assert len(handler.peers) == 1
+
+
+def test_dropped_connection_is_retried(smtp, outbox):
+    handler, _ = smtp
+    message_id = outbox.enqueue('drop@example.com', '建議報表', '內文')
+    assert wait_for(lambda: outbox.status(message_id)['status'] == 'sent')
+    status = outbox.status(message_id)
+    assert status['attempts'] == 2
+    assert handler.dropped == 1
+    assert handler.delivered == ['drop@example.com']
+    assert len(handler.peers) == 2  # 斷線後重新連線
+
+
+def test_malformed_message_does_not_block_queue(smtp, outbox):
+    handler, _ = smtp
+    bad = outbox.enqueue('customer@example.com\nBcc: other@example.com', '建議報表', '內文')
+    ok = outbox.enqueue('customer@example.com', '建議報表', '內文')
+    assert wait_for(lambda: outbox.status(ok)['status'] == 'sent')
+    status = outbox.status(bad)
+    assert status['status'] == 'failed'
+    assert status['attempts'] == 1
+    assert handler.delivered == ['customer@example.com']
@@ -0,0 +1,50 @@
+import pytest
+from mock_tg3d_server import MockTG3DServer
+from scan_index import ScanIndex
+from scan_poller import ScanPoller
+from tg3d_client import TG3DClient
+
+# --- 背景輪詢對本機 TG3D 替身的整合測試 ---
+# 輪詢每次只同步第一頁；索引較舊的部分還沒補齊 (有 gap) 時，新掃描的用戶資料仍要一起存進索引。
+
+
+@pytest.fixture
+def server():
+    server = MockTG3DServer(records=400).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def poller(server, tmp_path):
+    client = TG3DClient('test', base_url=server.base_url)
+    yield ScanPoller(client, ScanIndex(str(tmp_path / 'index.sqlite3')), interval=60)
+    client.close()
+
+
+def assert_loaded(poller, records):
+    recent = poller.recent(len(records))
+    assert [record['tid'] for record, _ in recent] == [record['tid'] for record in records]
+    for record, user_data in recent:
+        assert user_data is not None, record['tid']
+        assert user_data['user']['nick_name'] == f"顧客{record['user_id']}"
+        assert poller.is_warm(record['tid'])
+
+
+def test_poll_on_empty_index_stores_first_page(server, poller):
+    assert poller.poll_once() == 100  # 只同步第一頁，較舊的留給店員搜尋補齊
+    assert poller.scan_index.count() == 100
+    assert_loaded(poller, server.records[:poller.prefetch])
+    assert all(user_data is not None for _, user_data in poller.recent(100))
+
+
+def test_new_scans_get_user_data_while_gap_pending(server, poller):
+    poller.poll_once()
+    new = [server.add_record(user_id) for user_id in (7, 120, 399)][::-1]
+    assert poller.poll_once() == 3
+    assert_loaded(poller, new)
+
+    # 之後每一輪都維持完整，不會變回沒有用戶資料
+    server.add_record(250)
+    assert poller.poll_once() == 1
+    assert_loaded(poller, server.records[:4])
@@ -0,0 +1,186 @@
+import threading
+import time
+import concurrent.futures
+from dataclasses import dataclass, field
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import stage
+
+# --- TG3D API 共用連線客戶端 ---
+# app.py 與試衣間查詢頁共用：連線池 (keep-alive，免去每次 TLS 握手)、
+# 429/5xx 有限次數退避重試、可選的 token bucket 限流，以及一個共用的執行緒池。
+# 預設不限速率，同時在途的請求數由執行緒池大小 (max_workers) 限制，與原本每頁 20 條執行緒相同；
+# TG3D 真的回 429 時由重試處理 (會遵守 Retry-After)。
+
+BASE_URL = 'https://api.tg3ds.com/api/v1'
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# 各端點快取秒數：同一個 tid 的量測數據永遠不會變 (None = 不過期)；
+# 紀錄明細內的 icon_url 可能是有時效的連結，用戶資料可能改名，所以設定較短
+DEFAULT_CACHE_TTLS = {'users': 3600, 'size_xt': None, 'scan_record': 3600}
+
+
+class TG3DError(Exception):
+    pass
+
+
+def get_tg3d_float(data, key, default_val):
+    if not data: return default_val
+    item = data.get(key)
+    val = item.get('value') if isinstance(item, dict) else item
+    try:
+        return float(val)
+    except (ValueError, TypeError):
+        return default_val
+
+
+@dataclass
+class ScanMeasurements:
+    # 單次掃描的 I-Pose / A-Pose 量測與紀錄明細；errors 記錄個別失敗的部分
+    tid: object
+    pose_i: dict = field(default_factory=dict)
+    pose_a: dict = field(default_factory=dict)
+    detail: dict = field(default_factory=dict)
+    errors: dict = field(default_factory=dict)
+
+    @property
+    def icon_url(self):
+        return self.detail.get('icon_url', '')
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        # rate: 每秒補充的 token 數；burst: 桶子容量 (允許的瞬間併發量)
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class TG3DClient:
+    def __init__(self, apikey, base_url=BASE_URL, max_workers=20, timeout=10,
+                 max_retries=3, backoff=0.5, rate=None, burst=20, cache=None, cache_ttls=None):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_workers = max_workers
+        # rate: 每秒請求上限 (None 或 0 = 不限)，整個程序共用
+        self.limiter = TokenBucket(rate, burst) if rate else None
+        # cache: TTLCache (可省略)；查無資料、空白量測與錯誤都不會被快取
+        self.cache = cache
+        self.cache_ttls = dict(DEFAULT_CACHE_TTLS, **(cache_ttls or {}))
+
+        self.session = requests.Session()
+        self.session.params = {'apikey': apikey}
+        # 連線池大小與執行緒數一致，避免 "Connection pool is full" 而丟棄連線
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    @property
+    def executor(self):
+        # 整個程序共用一個執行緒池，不再每一頁都新開 20 條執行緒
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='tg3d')
+            return self._executor
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+    def _get(self, path, params=None, timeout=None):
+        url = f'{self.base_url}{path}'
+        for attempt in range(self.max_retries + 1):
+            if self.limiter: self.limiter.acquire()
+            try:
+                resp = self.session.get(url, params=params, timeout=timeout or self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.max_retries:
+                    raise TG3DError(f"連線 TG3D 失敗 ({path}): {e}") from e
+                time.sleep(self.backoff * (2 ** attempt))
+                continue
+            if resp.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                delay = self.backoff * (2 ** attempt)
+                retry_after = resp.headers.get('Retry-After')
+                if retry_after and retry_after.isdigit():
+                    delay = min(float(retry_after), 30.0)
+                time.sleep(delay)
+                continue
+            return resp
+
+    def _get_json(self, path, params=None, timeout=None):
+        resp = self._get(path, params=params, timeout=timeout)
+        if resp.status_code != 200:
+            raise TG3DError(f"TG3D 回應錯誤 ({path}): HTTP {resp.status_code}")
+        try:
+            return resp.json()
+        except ValueError as e:
+            raise TG3DError(f"TG3D 回應格式錯誤 ({path}): {e}") from e
+
+    def list_scan_records(self, limit=100, offset=0):
+        return self._get_json('/scan_records', params={'limit': limit, 'offset': offset}).get('records', [])
+
+    def _cached(self, namespace, key, loader):
+        if self.cache is None: return loader()
+        return self.cache.get_or_load(namespace, key, loader, ttl=self.cache_ttls.get(namespace))
+
+    def get_user(self, user_id):
+        # 查無此用戶回傳 None，其餘錯誤拋出 TG3DError
+        return self._cached('users', user_id, lambda: self._fetch_user(user_id))
+
+    def _fetch_user(self, user_id):
+        resp = self._get(f'/users/{user_id}', timeout=5)
+        if resp.status_code == 404: return None
+        if resp.status_code != 200:
+            raise TG3DError(f"TG3D 回應錯誤 (/users/{user_id}): HTTP {resp.status_code}")
+        try:
+            return resp.json()
+        except ValueError as e:
+            raise TG3DError(f"TG3D 回應格式錯誤 (/users/{user_id}): {e}") from e
+
+    def get_size_xt(self, tid, pose):
+        # 剛掃描完、尚未算好的空白量測不快取
+        return self._cached(
+            'size_xt', f'{tid}:{pose}',
+            lambda: self._get_json(f'/scan_records/{tid}/size_xt', params={'pose': pose}).get('measurement') or None,
+        ) or {}
+
+    def get_scan_record(self, tid):
+        return self._cached('scan_record', tid, lambda: self._get_json(f'/scan_records/{tid}'))
+
+    def fetch_measurements(self, tid):
+        # I-Pose、A-Pose 與紀錄明細三個請求同時送出，等待時間約等於最慢的那一個
+        # 注意：不要在 self.executor 的工作中呼叫，以免執行緒池被占滿而互相等待
+        futures = {
+            'pose_i': self.executor.submit(self.get_size_xt, tid, 'I'),
+            'pose_a': self.executor.submit(self.get_size_xt, tid, 'A'),
+            'detail': self.executor.submit(self.get_scan_record, tid),
+        }
+        result = ScanMeasurements(tid)
+        with stage('tg3d_measurements', items=len(futures)) as span:
+            for part, future in futures.items():
+                try:
+                    setattr(result, part, future.result() or {})
+                except TG3DError as e:
+                    result.errors[part] = str(e)
+            if result.errors: span.fail('TG3DError')
+        return result
@@ -0,0 +1,106 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# --- 跨 session 共用的 TTL + LRU 快取 ---
+# 以 (namespace, key) 存放，例如 ('users', user_id)、('size_xt', 'tid:I')；
+# ttl=None 代表永不過期 (只會被 LRU 擠掉)。可選擇寫入 SQLite 檔案，重啟後仍然有效；
+# 檔案同樣有筆數上限 (disk_maxsize)，依最後寫入 / 從檔案讀取的時間淘汰最舊的，不會無限長大。
+# 每個 namespace 各自統計命中 / 未命中次數。
+
+
+class TTLCache:
+    def __init__(self, maxsize=10000, path=None, disk_maxsize=None):
+        self.maxsize = maxsize
+        self.path = path
+        self.disk_maxsize = disk_maxsize or maxsize
+        # 每寫入這麼多筆才整理一次檔案 (檔案最多暫時超出上限約一成)
+        self._trim_every = max(1, self.disk_maxsize // 10)
+        self._writes = 0
+        self._data = OrderedDict()
+        self._stats = {}
+        self._lock = threading.Lock()
+        if path:
+            with self._connect() as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, expires REAL, value TEXT NOT NULL)")
+                columns = {row[1] for row in conn.execute("PRAGMA table_info(cache)")}
+                if 'used' not in columns:  # 舊版檔案沒有最後使用時間，視為最舊
+                    conn.execute("ALTER TABLE cache ADD COLUMN used REAL NOT NULL DEFAULT 0")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_used ON cache (used)")
+                self._trim(conn)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _trim(self, conn):
+        # 刪掉過期的，再只留下最近使用的 disk_maxsize 筆
+        conn.execute("DELETE FROM cache WHERE expires IS NOT NULL AND expires < ?", (time.time(),))
+        conn.execute("DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                     (self.disk_maxsize,))
+
+    def _count(self, namespace, field):
+        counters = self._stats.setdefault(namespace, {'hits': 0, 'misses': 0})
+        counters[field] += 1
+
+    def _store(self, full_key, expires, value):
+        self._data[full_key] = (expires, value)
+        self._data.move_to_end(full_key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def get(self, namespace, key):
+        # 回傳 (是否命中, 值)
+        full_key = f'{namespace}:{key}'
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(full_key)
+            if entry is not None:
+                if entry[0] is None or entry[0] > now:
+                    self._data.move_to_end(full_key)
+                    self._count(namespace, 'hits')
+                    return True, entry[1]
+                del self._data[full_key]
+
+        if self.path:
+            with self._connect() as conn:
+                row = conn.execute("SELECT expires, value FROM cache WHERE key = ?", (full_key,)).fetchone()
+                if row is not None: conn.execute("UPDATE cache SET used = ? WHERE key = ?", (now, full_key))
+            if row is not None and (row[0] is None or row[0] > now):
+                value = json.loads(row[1])
+                with self._lock:
+                    self._store(full_key, row[0], value)
+                    self._count(namespace, 'hits')
+                return True, value
+
+        with self._lock:
+            self._count(namespace, 'misses')
+        return False, None
+
+    def set(self, namespace, key, value, ttl=None):
+        full_key = f'{namespace}:{key}'
+        expires = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._store(full_key, expires, value)
+            self._writes += 1
+            trim = self._writes % self._trim_every == 0
+        if self.path:
+            with self._connect() as conn:
+                conn.execute("INSERT OR REPLACE INTO cache (key, expires, value, used) VALUES (?, ?, ?, ?)",
+                             (full_key, expires, json.dumps(value, ensure_ascii=False), time.time()))
+                if trim: self._trim(conn)
+
+    def get_or_load(self, namespace, key, loader, ttl=None):
+        # loader 回傳 None 時不快取 (例如查無此用戶，之後可能就會出現)
+        hit, value = self.get(namespace, key)
+        if hit: return value
+        value = loader()
+        if value is not None: self.set(namespace, key, value, ttl)
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {ns: dict(counters, size=sum(1 for k in self._data if k.startswith(ns + ':')))
+                    for ns, counters in self._stats.items()}